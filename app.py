@@ -1,40 +1,81 @@
-from flask import Flask, request, render_template, jsonify, Response
+from flask import Flask, request, render_template, jsonify, Response, g
+from werkzeug.formparser import FormDataParser
 from src.face_recognition_system import FaceRecognitionSystem
-from collections import defaultdict
+from src.face_pipeline import process_frames, process_frame_bytes, submit, FaceTracker, STAGES
+from src.training_jobs import TrainingScheduler
+from src.enrollment_store import EnrollmentStore, MAX_SESSION_FACES
 from src.encryption import key_manager
+from src.encryption.key_pool import key_pool
 from dotenv import load_dotenv
 from datetime import datetime
-from src.encryption.web_crypto_utils import encrypt_file_for_users, decrypt_file_for_user, get_current_user_id
+from src.encryption.web_crypto_utils import encrypt_file_for_users, open_decrypted_file, get_current_user_id, can_decrypt
+from src.encryption.user_directory import user_directory
+from src.encryption.groups import recipient_groups, GroupConflictError
+from src.storage.blob_store import get_blob_store
+from src.storage.metadata_store import get_metadata_store
+from src import metrics
 import os
-import pyrebase
 import mimetypes
 import json
 import cv2
 import numpy as np
 import base64
+import io
 import random
 import string
+import hashlib
+import time
+import threading
 
 load_dotenv()
 
+# Fork the key pool workers before any request threads exist
+key_pool.start()
+
 app = Flask(__name__)
 face_system = FaceRecognitionSystem()
-image_buffer = defaultdict(list)
-
-# Firebase configuration
-firebase_config = {
-    "apiKey": os.getenv('FIREBASE_API_KEY'),
-    "authDomain": os.getenv('FIREBASE_AUTH_DOMAIN'),
-    "projectId": os.getenv('FIREBASE_PROJECT_ID'),
-    "storageBucket": os.getenv('FIREBASE_STORAGE_BUCKET'),
-    "messagingSenderId": os.getenv('FIREBASE_MESSAGING_SENDER_ID'),
-    "appId": os.getenv('FIREBASE_APP_ID'),
-    "measurementId": os.getenv('FIREBASE_MEASUREMENT_ID'),
-    "databaseURL": f"https://{os.getenv('FIREBASE_PROJECT_ID')}-default-rtdb.firebaseio.com/"
-}
-
-firebase = pyrebase.initialize_app(firebase_config)
-db = firebase.database()
+# Load the model and run a warm-up prediction off the import path; /ready
+# reports 503 until it has finished
+threading.Thread(target=face_system.warm_up, name='face-warm-up', daemon=True).start()
+training_scheduler = TrainingScheduler(face_system)
+training_scheduler.start()
+blob_store = get_blob_store()
+
+# Enrollment faces live on local disk, shared by every worker process; only
+# detected 200x200 faces are kept, never the uploaded frames.
+enrollment_store = EnrollmentStore()
+MAX_FRAME_BYTES = 5 * 1024 * 1024
+
+# Users, vault and groups metadata: Firebase, or SQLite with METADATA_STORE=sqlite
+metadata = get_metadata_store()
+
+# Request latency by route and outcome; stages inside the request are
+# labelled with the same route (see src/metrics.py)
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.current_route.set(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def record_request_latency(response):
+    if 'request_started' in g:
+        outcome = g.get('outcome') or ('ok' if response.status_code < 400 else
+                                       'client_error' if response.status_code < 500 else 'error')
+        metrics.REQUEST_SECONDS.labels(metrics.current_route.get(), request.method, outcome).observe(
+            time.perf_counter() - g.request_started)
+    return response
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once the model is loaded and a warm-up prediction has run"""
+    if face_system.is_ready():
+        return jsonify({'ready': True, 'model_version': face_system.snapshot.version})
+    return jsonify({'ready': False}), 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
 
 # Main application routes
 @app.route('/')
@@ -63,64 +104,132 @@ def upload_captured_images():
         
         if not name or not images:
             return jsonify({'success': False, 'message': 'Name and images are required'})
-        image_buffer[name] = []
-        
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        processed_faces = []
+        enrollment_store.clear(name)
         
-        for i, image_data in enumerate(images):
-            try:
-                if ',' in image_data:
-                    encoded = image_data.split(",", 1)[1]
-                else:
-                    encoded = image_data
-            
-                image_bytes = base64.b64decode(encoded)
-                np_array = np.frombuffer(image_bytes, np.uint8)
-                img = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-                
-                if img is None:
-                    print(f"Warning: Could not decode image {i}")
-                    continue
-                
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-                
-                if len(faces) > 0:
-                    largest_face = max(faces, key=lambda f: f[2] * f[3])
-                    (x, y, w, h) = largest_face
-                
-                    face_roi = gray[y:y+h, x:x+w]
-                    face_roi = cv2.resize(face_roi, (200, 200))
-                
-                    processed_faces.append(face_roi)
-                    
-            except base64.binascii.Error as e:
-                print(f"Base64 decode error for image {i}: {e}")
-                continue
-            except Exception as e:
-                print(f"Error processing image {i}: {e}")
-                continue
+        processed_faces, timings = process_frames(images)
+        timings_ms = {stage: round(seconds * 1000, 2) for stage, seconds in timings.items() if stage != 'workers'}
+        print(f"Processed {len(images)} frames for {name} with {timings['workers']} workers: {timings_ms}")
         
         if len(processed_faces) >= 10:  
-            image_buffer[name] = processed_faces  
+            enrollment_store.stage(name, processed_faces)
             
             return jsonify({
                 'success': True, 
                 'message': f'Successfully processed {len(processed_faces)} face images for {name}',
-                'images_processed': len(processed_faces)
+                'images_processed': len(processed_faces),
+                'timings_ms': timings_ms
             })
         else:
             return jsonify({
                 'success': False, 
                 'message': f'Only {len(processed_faces)} valid face images found. Please ensure your face is clearly visible.',
-                'images_processed': len(processed_faces)
+                'images_processed': len(processed_faces),
+                'timings_ms': timings_ms
             })
             
     except Exception as e:
         print(f"Upload error: {e}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+@app.route('/enrollment_session', methods=['POST'])
+def start_enrollment_session():
+    """Open a streaming enrollment session"""
+    data = request.get_json()
+    name = data.get('name') if data else None
+    if not name:
+        return jsonify({'success': False, 'message': 'Name is required'})
+
+    session_id = enrollment_store.open_session(name, STAGES)
+    return jsonify({'success': True, 'session_id': session_id, 'total_needed': MAX_SESSION_FACES})
+
+def _read_frame():
+    """Return the frame bytes (raw body or multipart 'frame'), or None if the
+    body exceeds MAX_FRAME_BYTES. The body is read from request.stream, so
+    chunked requests without a Content-Length are bounded too."""
+    chunks = []
+    size = 0
+    while size <= MAX_FRAME_BYTES:
+        chunk = request.stream.read(MAX_FRAME_BYTES + 1 - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    if size > MAX_FRAME_BYTES:
+        return None
+    body = b''.join(chunks)
+    if request.mimetype == 'multipart/form-data':
+        _, _, files = FormDataParser().parse(io.BytesIO(body), request.mimetype, len(body),
+                                             request.mimetype_params)
+        frame = files.get('frame')
+        return frame.read() if frame else b''
+    return body
+
+@app.route('/enrollment_session/<session_id>/frame', methods=['POST'])
+def upload_enrollment_frame(session_id):
+    """Accept one binary frame (raw body or multipart 'frame') and detect its face immediately"""
+    session = enrollment_store.session(session_id)
+    if session is None:
+        return jsonify({'success': False, 'message': 'Unknown enrollment session'}), 404
+
+    if request.content_length and request.content_length > MAX_FRAME_BYTES:
+        return jsonify({'success': False, 'message': 'Frame too large'}), 413
+
+    if session['faces'] >= MAX_SESSION_FACES:
+        return jsonify({'success': True, 'face_detected': False, 'images_processed': session['faces']})
+
+    image_bytes = _read_frame()
+    if image_bytes is None:
+        return jsonify({'success': False, 'message': 'Frame too large'}), 413
+    if not image_bytes:
+        return jsonify({'success': False, 'message': 'Empty frame'}), 400
+
+    # The tracker box travels with the session, so any worker can take the next frame
+    tracker = FaceTracker()
+    tracker.box = tuple(session['box']) if session['box'] else None
+    try:
+        face_roi, timings = submit(process_frame_bytes, image_bytes, tracker).result()
+    except Exception as e:
+        print(f"Error processing streamed frame: {e}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+    count = enrollment_store.add_frame(session_id, face_roi, timings, tracker.box)
+    if count is None:
+        return jsonify({'success': False, 'message': 'Unknown enrollment session'}), 404
+
+    return jsonify({
+        'success': True,
+        'face_detected': face_roi is not None,
+        'images_processed': count
+    })
+
+@app.route('/enrollment_session/<session_id>/finish', methods=['POST'])
+def finish_enrollment_session(session_id):
+    """Close a streaming session and stage its faces for /register_face"""
+    session = enrollment_store.finish_session(session_id)
+    if session is None:
+        return jsonify({'success': False, 'message': 'Unknown enrollment session'}), 404
+
+    name = session['name']
+    face_count = session['faces']
+    timings_ms = {stage: round(seconds * 1000, 2) for stage, seconds in session['timings'].items()}
+
+    if face_count >= 10:
+        return jsonify({
+            'success': True,
+            'message': f'Successfully processed {face_count} face images for {name}',
+            'images_processed': face_count,
+            'frames_received': session['frames_received'],
+            'timings_ms': timings_ms
+        })
+    enrollment_store.clear(name)
+    return jsonify({
+        'success': False,
+        'message': f'Only {face_count} valid face images found. Please ensure your face is clearly visible.',
+        'images_processed': face_count,
+        'frames_received': session['frames_received'],
+        'timings_ms': timings_ms
+    })
+
 @app.route('/register_face', methods=['POST'])
 def register_face():
     """Register face using captured images"""
@@ -131,11 +240,13 @@ def register_face():
         if not name:
             return jsonify({'success': False, 'message': 'Name is required'})
         
-        if name not in image_buffer or len(image_buffer[name]) < 10:
+        face_images = enrollment_store.staged_faces(name)
+        if face_images is None or len(face_images) < 10:
             return jsonify({'success': False, 'message': 'Not enough images captured. Please capture images first.'})
 
-        face_images = image_buffer[name]
-        success = face_system.register_face(name, face_images)
+        # Samples are stored now; the model update runs in the background
+        job = training_scheduler.submit(name, face_images)
+        enrollment_store.clear(name)
         user_id = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
         public_key = key_manager.generate_keys(user_id)
         
@@ -147,36 +258,48 @@ def register_face():
         
         print(f"Generated public key for {name}: {public_key_str}")
 
-        # Store user data directly in Firebase
+        # Store user data in the metadata store
         try:
             user_data = {
                 'username': name,
                 'userid': user_id,
                 'public_key': public_key_str,
+                'key_algorithm': key_manager.KEY_ALGORITHM,
                 'created_at': datetime.now().isoformat()
             }
             
-            result = db.child("users").push(user_data)
-            print(f"User data stored in Firebase with ID: {result['name']}")
+            user_key = metadata.add_user(user_data)
+            user_directory.add(user_data)
+            print(f"User data stored with ID: {user_key}")
             
-        except Exception as firebase_error:
-            print(f"Firebase error: {firebase_error}")
+        except Exception as store_error:
+            print(f"Metadata store error: {store_error}")
         
-        if success:
-            image_buffer[name] = []
-            return jsonify({'success': True, 'message': f'Face registered successfully for {name}'})
-        else:
-            return jsonify({'success': False, 'message': 'Face registration failed'})
+        return jsonify({
+            'success': True,
+            'message': f'Face registered for {name}, training queued',
+            'job_id': job['job_id'],
+            'status': job['status']
+        })
             
     except Exception as e:
         print(f"Error in register_face: {e}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+@app.route('/training_status/<job_id>')
+def training_status(job_id):
+    """Report a registration's training job: queued, running, done or failed"""
+    job = training_scheduler.status(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown training job'}), 404
+    job['current_model_version'] = face_system.snapshot.version
+    return jsonify({'success': True, **job})
+
 @app.route('/get_capture_status/<name>')
 def get_capture_status(name):
     """Get current capture status for a user"""
-    count = len(image_buffer.get(name, []))
-    return jsonify({'images_captured': count, 'total_needed': 50})
+    count = enrollment_store.staged_count(name)
+    return jsonify({'images_captured': count, 'total_needed': MAX_SESSION_FACES})
 
 @app.route('/list_users')
 def list_users():
@@ -203,21 +326,28 @@ def authenticate_face():
         image_data = data.get('image')
         
         if not image_data:
+            g.outcome = 'invalid'
             return jsonify({'success': False, 'message': 'Image is required'})
 
-        if ',' in image_data:
-            encoded = image_data.split(",", 1)[1]
-        else:
-            encoded = image_data
-        
-        image_bytes = base64.b64decode(encoded)
-        np_array = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+        with metrics.stage_timer('base64_decode'):
+            if ',' in image_data:
+                encoded = image_data.split(",", 1)[1]
+            else:
+                encoded = image_data
+            image_bytes = base64.b64decode(encoded)
+
+        with metrics.stage_timer('imdecode') as timer:
+            np_array = np.frombuffer(image_bytes, np.uint8)
+            img = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+            if img is None:
+                timer.outcome = 'error'
         
         if img is None:
+            g.outcome = 'invalid'
             return jsonify({'success': False, 'message': 'Could not decode image'})
         
         result = face_system.authenticate_face_from_image(img)
+        g.outcome = 'recognized' if result else 'rejected'
         
         if result:
             return jsonify({
@@ -237,21 +367,104 @@ def authenticate_face():
             })
             
     except Exception as e:
+        g.outcome = 'error'
         print(f"Error in authenticate_face: {e}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
-# Firebase API routes
+@app.route('/authenticate_batch', methods=['POST'])
+def authenticate_batch():
+    """Authenticate from several frames in one request, voting across them"""
+    try:
+        data = request.get_json()
+        images = data.get('images', [])
+
+        if not images:
+            g.outcome = 'invalid'
+            return jsonify({'success': False, 'message': 'Images are required'})
+
+        result, stats = face_system.authenticate_frames(images)
+        g.outcome = 'recognized' if result else 'rejected'
+
+        if result:
+            return jsonify({
+                'success': True,
+                'message': f'Welcome back, {result["name"]}!',
+                'user': {
+                    'name': str(result['name']),
+                    'confidence': float(result['confidence']),
+                    'confidence_percent': float(result['confidence_percent']),
+                    'user_id': int(result['user_id'])
+                },
+                'stats': stats
+            })
+        return jsonify({
+            'success': False,
+            'message': 'Face not recognized. Please try again or register first.',
+            'stats': stats
+        })
+
+    except Exception as e:
+        g.outcome = 'error'
+        print(f"Error in authenticate_batch: {e}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+# Metadata API routes
+# Fields returned by the vault listing unless ?fields= asks for others.
+# File content and wrapped keys are never needed to render the list.
+VAULT_LIST_FIELDS = ('title', 'file_name', 'file_extension', 'file_type', 'file_size',
+                     'uploaded_at', 'sender_id', 'sender_username', 'recipients', 'is_encrypted')
+VAULT_PAGE_SIZE = 50
+VAULT_MAX_PAGE_SIZE = 200
+
 @app.route('/api/vault', methods=['GET'])
 def get_vault_items():
+    """
+    List vault metadata one page at a time.
+    Query params: limit, cursor (from the X-Next-Cursor header), fields
+    (comma separated), sender (sender_id) and recipient (userid).
+    """
     try:
-        items = db.child("vault").get()
-        if items.val():
-            vault_list = []
-            for key, item in items.val().items():
-                item['id'] = key
-                vault_list.append(item)
-            return jsonify(vault_list)
-        return jsonify([])
+        limit = int(request.args.get('limit', VAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    # At least one item per page, or the next cursor would repeat this one
+    limit = max(1, min(limit, VAULT_MAX_PAGE_SIZE))
+    try:
+        cursor = request.args.get('cursor') or None
+        sender_id = request.args.get('sender')
+        recipient_id = request.args.get('recipient')
+        fields = request.args.get('fields')
+        fields = [f for f in fields.split(',') if f] if fields else VAULT_LIST_FIELDS
+
+        vault_list = []
+        next_cursor = None
+        while True:
+            page = metadata.vault_page(cursor, limit + 1, sender_id)
+            has_more = len(page) > limit
+            for key, item in page[:limit]:
+                if recipient_id and not any(r.get('userid') == recipient_id or
+                                            (r.get('group_id') and recipient_groups.is_member(r['group_id'], recipient_id))
+                                            for r in item.get('recipients', [])):
+                    continue
+                if len(vault_list) == limit:
+                    next_cursor = key
+                    break
+                projected = {field: item[field] for field in fields if field in item}
+                projected['id'] = key
+                vault_list.append(projected)
+            if next_cursor or not has_more:
+                break
+            cursor = page[limit][0]
+            if len(vault_list) == limit:
+                next_cursor = cursor
+                break
+
+        response = jsonify(vault_list)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        response.set_etag(hashlib.sha256(response.get_data() + (next_cursor or '').encode()).hexdigest())
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -267,10 +480,8 @@ def add_vault_item():
         if not file:
             return jsonify({"error": "No file provided"}), 400
         
-        # Read file content and encode as base64
-        file_content = file.read()
-        import base64
-        encoded_content = base64.b64encode(file_content).decode('utf-8')
+        # Stream the raw file into the blob store; the DB keeps only the reference
+        blob = blob_store.put_stream(file.stream)
         
         # Get file info
         file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'unknown'
@@ -279,17 +490,17 @@ def add_vault_item():
         vault_data = {
             'title': data.get('title', file.filename),
             'file_name': file.filename,
-            'file_content': encoded_content,
             'file_extension': file_extension,
             'file_type': mime_type,
-            'file_size': len(file_content),
+            'file_size': blob['blob_size'],
+            'blob_id': blob['blob_id'],
+            'checksum': blob['checksum'],
             'uploaded_at': datetime.now().isoformat()
         }
         
-        # Store in Firebase
-        result = db.child("vault").push(vault_data)
+        item_id = metadata.add_vault_item(vault_data)
         
-        return jsonify({"message": "File uploaded successfully", "id": result['name']})
+        return jsonify({"message": "File uploaded successfully", "id": item_id})
         
     except Exception as e:
         print(f"Error in add_vault_item: {e}")
@@ -298,28 +509,74 @@ def add_vault_item():
 @app.route('/api/vault/<item_id>', methods=['DELETE'])
 def delete_vault_item(item_id):
     try:
-        db.child("vault").child(item_id).remove()
+        item = metadata.vault_item(item_id)
+        metadata.delete_vault_item(item_id)
+        # Encrypted blobs are unique per upload; plain blobs may be shared by
+        # identical uploads and are removed by a background sweep once unreferenced.
+        if item and item.get('is_encrypted') and item.get('encrypted_data', {}).get('blob_id'):
+            blob_store.delete(item['encrypted_data']['blob_id'])
+        elif item and item.get('blob_id'):
+            blob_store.maybe_sweep(metadata)
         return jsonify({"message": "Item deleted successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _ranged_response(total_size, read_range, etag, mimetype, filename):
+    """
+    Stream read_range(start, stop) with conditional GET and single-range
+    support: If-None-Match gives 304, a satisfiable Range gives 206 and an
+    unsatisfiable one 416. If-Range falls back to the full body on mismatch.
+    """
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes"
+    }
+    start, stop = 0, total_size
+    status = 200
+
+    if request.method == 'GET':
+        if etag in request.if_none_match:
+            response = Response(status=304, headers=headers)
+            response.set_etag(etag)
+            return response
+
+        byte_range = request.range
+        if_range = request.headers.get('If-Range')
+        if byte_range is not None and len(byte_range.ranges) == 1 and (not if_range or if_range.strip('"') == etag):
+            bounds = byte_range.range_for_length(total_size)
+            if bounds is None:
+                return Response(status=416, headers={"Content-Range": f"bytes */{total_size}"})
+            start, stop = bounds
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{total_size}"
+
+    response = Response(read_range(start, stop), status=status, mimetype=mimetype, headers=headers)
+    response.content_length = stop - start
+    response.set_etag(etag)
+    return response
+
 @app.route('/api/vault/<item_id>/download-file', methods=['GET'])
 def download_file_direct(item_id):
     try:
-        item = db.child("vault").child(item_id).get()
-        if not item.val():
+        item_data = metadata.vault_item(item_id)
+        if not item_data:
             return jsonify({"error": "File not found"}), 404
         
-        item_data = item.val()
-        
-        # Decode base64 content
-        import base64
-        file_content = base64.b64decode(item_data['file_content'])
-        
-        return Response(
-            file_content,
-            mimetype=item_data.get('file_type', 'application/octet-stream'),
-            headers={"Content-Disposition": f"attachment; filename={item_data.get('file_name', 'download')}"})
+        if item_data.get('blob_id'):
+            blob_id = item_data['blob_id']
+            total_size = blob_store.size(blob_id)
+            read_range = lambda start, stop: blob_store.iter_chunks(blob_id, start, stop - start)
+            etag = blob_id
+        else:
+            # Items stored before the blob store keep base64 content in the DB
+            file_content = base64.b64decode(item_data['file_content'])
+            total_size = len(file_content)
+            read_range = lambda start, stop: iter([file_content[start:stop]])
+            etag = hashlib.sha256(file_content).hexdigest()
+        
+        return _ranged_response(total_size, read_range, etag,
+                                item_data.get('file_type', 'application/octet-stream'),
+                                item_data.get('file_name', 'download'))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -329,9 +586,9 @@ def add_user():
         data = request.json
         
         # Generate key pair for the user
-        key_pair = key_manager.generate_key_pair()
+        key_pair = key_manager.generate_key_pair(data.get('key_algorithm', key_manager.KEY_ALGORITHM))
         
-        # Store public key in Firebase, private key locally
+        # Store public key in the metadata store, private key locally
         public_key_pem = key_manager.serialize_public_key(key_pair['public_key'])
         key_manager.store_private_key(data['userid'], key_pair['private_key'])
         
@@ -339,11 +596,13 @@ def add_user():
             'username': data['username'],
             'userid': data['userid'],
             'public_key': public_key_pem,
+            'key_algorithm': key_manager.key_algorithm(key_pair['public_key']),
             'created_at': datetime.now().isoformat()
         }
         
-        result = db.child("users").push(user_data)
-        return jsonify({"message": "User created successfully", "id": result['name']})
+        user_key = metadata.add_user(user_data)
+        user_directory.add(user_data)
+        return jsonify({"message": "User created successfully", "id": user_key})
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -351,10 +610,11 @@ def add_user():
 @app.route('/api/users', methods=['GET'])
 def get_users():
     try:
-        users = db.child("users").get()
-        if users.val():
+        users = metadata.users()
+        if users:
+            user_directory.prime(users)
             user_list = []
-            for key, user_data in users.val().items():
+            for key, user_data in users.items():
                 user_list.append({
                     'id': key,
                     'username': user_data.get('username'),
@@ -366,6 +626,80 @@ def get_users():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/keys/cache-stats', methods=['GET'])
+def get_key_cache_stats():
+    return jsonify(key_manager.private_key_cache.stats())
+
+@app.route('/api/keys/pool-stats', methods=['GET'])
+def get_key_pool_stats():
+    return jsonify(key_pool.stats())
+
+def _group_summary(group_id, group):
+    return {
+        'id': group_id,
+        'name': group.get('name'),
+        'owner_id': group.get('owner_id'),
+        'members': list(group.get('members', {})),
+        'version': group.get('version'),
+        'created_at': group.get('created_at')
+    }
+
+@app.route('/api/groups', methods=['GET'])
+def get_groups():
+    try:
+        member_id = request.args.get('member')
+        groups = recipient_groups.list()
+        return jsonify([_group_summary(group_id, group) for group_id, group in groups.items()
+                        if not member_id or member_id in group.get('members', {})])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/groups', methods=['POST'])
+def create_group():
+    try:
+        data = request.json
+        owner_id = get_current_user_id(data.get('current_user'))
+        if not owner_id:
+            return jsonify({"error": "Current user not identified"}), 400
+        if not data.get('name'):
+            return jsonify({"error": "Group name required"}), 400
+        
+        group_id, group = recipient_groups.create(data['name'], owner_id, data.get('members', []))
+        return jsonify(_group_summary(group_id, group))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/groups/<group_id>/members', methods=['POST', 'DELETE'])
+def update_group_members(group_id):
+    """
+    POST adds members (one key wrap each). DELETE removes them and rotates
+    the group key, rewrapping it for the remaining members.
+    Body: {current_user, members: [userid, ...]}
+    """
+    try:
+        data = request.json
+        actor_id = get_current_user_id(data.get('current_user'))
+        if not actor_id:
+            return jsonify({"error": "Current user not identified"}), 400
+        
+        if request.method == 'POST':
+            changed = recipient_groups.add_members(group_id, actor_id, data.get('members', []))
+        else:
+            changed = recipient_groups.remove_members(group_id, actor_id, data.get('members', []))
+        return jsonify({"changed": changed, **_group_summary(group_id, recipient_groups.get(group_id))})
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except GroupConflictError as e:
+        return jsonify({"error": str(e)}), 409
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/users/face/<user_name>', methods=['DELETE'])
 def delete_face_user(user_name):
     try:
@@ -373,6 +707,8 @@ def delete_face_user(user_name):
         success = face_system.delete_user(user_name)
         
         if success:
+            # Compacts the deleted samples away once enough have built up
+            training_scheduler.request_rebuild()
             return jsonify({"message": f"User {user_name} deleted successfully"})
         else:
             return jsonify({"error": "User not found"}), 404
@@ -389,16 +725,18 @@ def add_encrypted_vault_item():
         data = request.form.to_dict()
         file = request.files.get('file')
         recipients_json = request.form.get('recipients')
+        groups_json = request.form.get('groups')
         
         if not file:
             return jsonify({"error": "No file provided"}), 400
             
-        if not recipients_json:
+        if not recipients_json and not groups_json:
             return jsonify({"error": "No recipients specified"}), 400
         
-        # Parse recipients
+        # Parse recipients and recipient group ids
         try:
-            recipients = json.loads(recipients_json)
+            recipients = json.loads(recipients_json) if recipients_json else []
+            group_ids = json.loads(groups_json) if groups_json else []
         except:
             return jsonify({"error": "Invalid recipients format"}), 400
         
@@ -411,14 +749,23 @@ def add_encrypted_vault_item():
         if not sender_user_id:
             return jsonify({"error": "Sender user ID not found"}), 400
         
-        # Read file content
-        file_content = file.read()
-        
         # Get recipient user IDs
-        recipient_user_ids = [r['userid'] for r in recipients]
-        
-        # Encrypt file for all recipients
-        encrypted_data = encrypt_file_for_users(file_content, sender_user_id, recipient_user_ids)
+        recipient_user_ids = [r['userid'] for r in recipients if 'userid' in r]
+        
+        # Groups are listed as recipients too; their members are not expanded
+        for group_id in group_ids:
+            group = recipient_groups.get(group_id)
+            if not group:
+                return jsonify({"error": f"Group {group_id} not found"}), 400
+            recipients.append({'group_id': group_id, 'name': group['name'], 'member_count': len(group['members'])})
+        
+        # Encrypt file for all recipients, streaming ciphertext into the blob store.
+        # A group costs one AES key wrap, however many members it has.
+        with blob_store.writer() as writer:
+            encrypted_data = encrypt_file_for_users(file.stream, sender_user_id, recipient_user_ids,
+                                                    output=writer, group_ids=group_ids)
+            blob = writer.commit()
+        encrypted_data.update(blob)
         
         # Prepare data for storage
         file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'unknown'
@@ -429,7 +776,7 @@ def add_encrypted_vault_item():
             'file_name': file.filename,
             'file_extension': file_extension,
             'file_type': mime_type,
-            'file_size': len(file_content),
+            'file_size': encrypted_data['plaintext_size'],
             'uploaded_at': datetime.now().isoformat(),
             'sender_id': sender_user_id,
             'sender_username': current_username,
@@ -438,20 +785,21 @@ def add_encrypted_vault_item():
             'encrypted_data': encrypted_data
         }
         
-        # Store in Firebase
-        result = db.child("vault").push(vault_data)
+        item_id = metadata.add_vault_item(vault_data)
         
         return jsonify({
             "message": "Encrypted file uploaded successfully", 
-            "id": result['name'],
+            "id": item_id,
             "recipients": len(recipients)
         })
         
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
     except Exception as e:
         print(f"Encryption upload error: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/vault/<item_id>/decrypt', methods=['POST'])
+@app.route('/api/vault/<item_id>/decrypt', methods=['GET', 'POST'])
 def decrypt_vault_item(item_id):
     try:
         # Get current user info
@@ -467,36 +815,33 @@ def decrypt_vault_item(item_id):
         if not current_user_id:
             return jsonify({"error": "User ID not found"}), 400
         
-        # Get file from Firebase
-        item = db.child("vault").child(item_id).get()
-        if not item.val():
+        item_data = metadata.vault_item(item_id)
+        if not item_data:
             return jsonify({"error": "File not found"}), 404
         
-        item_data = item.val()
-        
         if not item_data.get('is_encrypted'):
             return jsonify({"error": "File is not encrypted"}), 400
         
         # Check if user has permission to decrypt
         encrypted_data = item_data.get('encrypted_data', {})
-        if current_user_id not in encrypted_data.get('encrypted_keys', {}):
+        if not can_decrypt(encrypted_data, current_user_id):
             return jsonify({"error": "You don't have permission to decrypt this file"}), 403
         
-        # Decrypt file
-        decrypted_content = decrypt_file_for_user(encrypted_data, current_user_id)
+        # Decrypt file as it streams; a Range only decrypts the chunks it covers
+        blob_id = encrypted_data.get('blob_id')
+        open_ciphertext = (lambda: blob_store.open(blob_id)) if blob_id else None
+        total_size, read_range = open_decrypted_file(encrypted_data, current_user_id, open_ciphertext)
+        etag = blob_id or hashlib.sha256(encrypted_data['encrypted_content'].encode('utf-8')).hexdigest()
         
-        # Return decrypted file
-        return Response(
-            decrypted_content,
-            mimetype=item_data.get('file_type', 'application/octet-stream'),
-            headers={
-                "Content-Disposition": f"attachment; filename={item_data.get('file_name', 'decrypted_file')}"
-            }
-        )
+        return _ranged_response(total_size, read_range, etag,
+                                item_data.get('file_type', 'application/octet-stream'),
+                                item_data.get('file_name', 'decrypted_file'))
         
     except Exception as e:
         print(f"Decryption error: {e}")
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, port=8001)
\ No newline at end of file
+    # Development server. For production run several worker processes, e.g.
+    # gunicorn -w 4 --threads 4 -b 0.0.0.0:8001 app:app (see README).
+    app.run(debug=os.getenv('FLASK_DEBUG', '1') == '1', port=int(os.getenv('PORT', 8001)), threaded=True)
\ No newline at end of file
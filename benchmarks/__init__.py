@@ -0,0 +1,10 @@
+"""Offline benchmarks for the face pipeline and crypto hot paths.
+
+Run everything and save one JSON file per run:
+
+    python -m benchmarks [--quick] [--output results.json]
+
+and compare two runs with ``python -m benchmarks.compare old.json new.json``.
+Nothing touches Firebase or a camera: images are synthetic and metadata is
+kept in a temporary SQLite store.
+"""
@@ -0,0 +1,42 @@
+"""Run every benchmark and write one JSON report.
+
+    python -m benchmarks [--quick] [--output PATH]
+"""
+import argparse
+import io
+import json
+import os
+import time
+from contextlib import redirect_stdout
+
+from benchmarks import crypto, face_pipeline, key_wrap
+from benchmarks.common import environment
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run all benchmarks")
+    parser.add_argument('--quick', action='store_true', help="small sizes for a smoke run")
+    parser.add_argument('--output', help="report path (default benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+    quick = ['--quick'] if args.quick else []
+
+    report = {'environment': environment(), 'quick': args.quick, 'benchmarks': {}}
+    for name, run in (('face_pipeline', lambda: face_pipeline.main(quick)['results']),
+                      ('crypto', lambda: crypto.main(quick)['results']),
+                      ('key_wrap', lambda: key_wrap.main(50 if args.quick else 200))):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            report['benchmarks'][name] = run()
+        print(f"{name}: {time.perf_counter() - start:.1f}s")
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
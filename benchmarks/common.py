@@ -0,0 +1,75 @@
+"""Timing helpers and synthetic inputs shared by the benchmarks"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+
+def timed(fn, repeat=5, warmup=1):
+    """Median and minimum wall time of fn() in seconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {'median_s': statistics.median(samples), 'min_s': min(samples), 'repeat': repeat}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def emit(name, results):
+    report = {'benchmark': name, 'environment': environment(), 'results': results}
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def synthetic_face(rng):
+    """A smooth random 200x200 texture standing in for one person's face"""
+    face = cv2.GaussianBlur(rng.normal(128, 60, (200, 200)).astype(np.float32), (0, 0), 6)
+    return cv2.normalize(face, None, 40, 215, cv2.NORM_MINMAX)
+
+
+def face_samples(base, rng, count):
+    """Capture-burst style samples of one face: drifting pose, brightness and noise"""
+    samples = []
+    dx = dy = angle = brightness = 0.0
+    for _ in range(count):
+        dx += rng.normal(0, 0.6)
+        dy += rng.normal(0, 0.6)
+        angle += rng.normal(0, 0.5)
+        brightness += rng.normal(0, 2)
+        matrix = cv2.getRotationMatrix2D((100, 100), angle, 1 + rng.normal(0, 0.01))
+        matrix[:, 2] += (dx, dy)
+        face = cv2.warpAffine(base, matrix, (200, 200), borderMode=cv2.BORDER_REFLECT) + brightness
+        face = face + rng.normal(0, 4, face.shape)
+        samples.append(np.clip(face, 0, 255).astype(np.uint8))
+    return samples
+
+
+def synthetic_frame(rng, width, height):
+    """A camera-sized grayscale frame with smooth structure and noise"""
+    frame = cv2.GaussianBlur(rng.normal(128, 50, (height, width)).astype(np.float32), (0, 0), 4)
+    frame = frame + rng.normal(0, 6, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
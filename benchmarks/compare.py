@@ -0,0 +1,57 @@
+"""Compare two benchmark reports written by ``python -m benchmarks``.
+
+    python -m benchmarks.compare old.json new.json [--threshold 0.1]
+
+Every median timing present in both reports is printed with its ratio
+(new / old); changes beyond the threshold are flagged.
+"""
+import argparse
+import json
+
+
+def _timings(node, path=()):
+    """Yield (path, median seconds) for every timing in a report"""
+    if isinstance(node, dict):
+        if 'median_s' in node:
+            yield path, node['median_s']
+            return
+        for key, value in node.items():
+            yield from _timings(value, path + (key,))
+    elif isinstance(node, list):
+        for item in node:
+            # Identify list rows by their parameters rather than their position
+            label = ','.join(f"{k}={v}" for k, v in item.items()
+                             if isinstance(v, (str, int)) and not isinstance(v, bool)) if isinstance(item, dict) else ''
+            yield from _timings(item, path + (f"[{label}]",))
+
+
+def compare(old, new, threshold=0.1):
+    old_timings = dict(_timings(old['benchmarks']))
+    rows = []
+    for path, seconds in _timings(new['benchmarks']):
+        if path in old_timings and old_timings[path] > 0:
+            ratio = seconds / old_timings[path]
+            flag = 'slower' if ratio > 1 + threshold else 'faster' if ratio < 1 - threshold else ''
+            rows.append(('/'.join(path), old_timings[path], seconds, ratio, flag))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"old: {old['environment'].get('commit')}  new: {new['environment'].get('commit')}")
+    for path, old_s, new_s, ratio, flag in compare(old, new, args.threshold):
+        print(f"{path:90s} {old_s * 1000:10.3f}ms {new_s * 1000:10.3f}ms {ratio:6.2f}x {flag}")
+
+
+if __name__ == '__main__':
+    main()
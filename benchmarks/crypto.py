@@ -0,0 +1,109 @@
+"""encrypt_file_for_users / decrypt_file_for_user throughput.
+
+Users, keys and groups live in a temporary directory, with metadata in a
+SQLite store there instead of Firebase. Run from the repository root:
+
+    python -m benchmarks.crypto [--quick] [--algorithm RSA|X25519]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+from benchmarks.common import timed, emit
+from src.encryption import key_manager
+from src.encryption.groups import recipient_groups
+from src.encryption.web_crypto_utils import encrypt_file_for_users, decrypt_file_for_user
+from src.storage.metadata_store import SQLiteMetadataStore, set_metadata_store
+
+FILE_SIZES = (64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+RECIPIENTS = (1, 10, 100)
+
+
+def create_users(metadata, count, algorithm):
+    user_ids = []
+    for i in range(count):
+        user_id = f"bench{i:05d}"
+        key_pair = key_manager.generate_key_pair(algorithm)
+        key_manager.store_private_key(user_id, key_pair['private_key'])
+        metadata.add_user({
+            'username': f"bench-user-{i}",
+            'userid': user_id,
+            'public_key': key_manager.serialize_public_key(key_pair['public_key']),
+            'key_algorithm': algorithm
+        })
+        user_ids.append(user_id)
+    return user_ids
+
+
+def _mb_per_s(size, timing):
+    return round(size / timing['median_s'] / 1e6, 2)
+
+
+def bench_case(size, sender, recipients, group_id, repeat):
+    content = os.urandom(size)
+    group_ids = [group_id] if group_id else []
+    direct = [] if group_id else recipients
+
+    def encrypt():
+        return encrypt_file_for_users(content, sender, direct, output=io.BytesIO(), group_ids=group_ids)
+
+    output = io.BytesIO()
+    encrypted = encrypt_file_for_users(content, sender, direct, output=output, group_ids=group_ids)
+    ciphertext = output.getvalue()
+    reader = recipients[-1]
+
+    def decrypt():
+        return decrypt_file_for_user(encrypted, reader, io.BytesIO(ciphertext))
+
+    assert decrypt() == content
+    encrypt_timing = timed(encrypt, repeat)
+    decrypt_timing = timed(decrypt, repeat)
+    return {
+        'file_size': size,
+        'recipients': len(recipients),
+        'sharing': 'group' if group_id else 'direct',
+        'wrapped_keys': len(encrypted['encrypted_keys']) + len(encrypted.get('group_keys', {})),
+        'encrypt': encrypt_timing,
+        'decrypt': decrypt_timing,
+        'encrypt_mb_per_s': _mb_per_s(size, encrypt_timing),
+        'decrypt_mb_per_s': _mb_per_s(size, decrypt_timing)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help="small sizes for a smoke run")
+    parser.add_argument('--algorithm', default='RSA', choices=('RSA', 'X25519'))
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    sizes = FILE_SIZES[:2] if args.quick else FILE_SIZES
+    recipient_counts = RECIPIENTS[:2] if args.quick else RECIPIENTS
+
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, redirect_stdout(sys.stderr):
+        # key_manager keeps private keys under data/keys relative to the cwd
+        os.chdir(work_dir)
+        try:
+            metadata = SQLiteMetadataStore(os.path.join(work_dir, 'metadata.db'))
+            set_metadata_store(metadata)
+            user_ids = create_users(metadata, max(recipient_counts) + 1, args.algorithm)
+            sender = user_ids[0]
+            for count in recipient_counts:
+                recipients = user_ids[1:count + 1]
+                group_id, _ = recipient_groups.create(f"bench-{count}", sender, recipients)
+                for size in sizes:
+                    for group in (None, group_id):
+                        results.append(bench_case(size, sender, recipients, group, args.repeat))
+        finally:
+            os.chdir(cwd)
+
+    return emit('crypto', {'algorithm': args.algorithm, 'cases': results})
+
+
+if __name__ == '__main__':
+    main()
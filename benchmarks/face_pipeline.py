@@ -0,0 +1,140 @@
+"""Face detection, prediction and training latency on synthetic images.
+
+Run from the repository root:
+
+    python -m benchmarks.face_pipeline [--quick] [--users 10,100,1000,10000]
+"""
+import argparse
+import itertools
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+import cv2
+import numpy as np
+
+from benchmarks.common import timed, emit, synthetic_face, face_samples, synthetic_frame
+from src import face_pipeline
+from src.face_matcher import GalleryMatcher
+from src.face_recognition_system import FaceRecognitionSystem, ModelSnapshot
+from src.lbph_model import SegmentedLBPH
+
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720), (1920, 1080))
+GALLERY_USERS = (10, 100, 1000, 10000)
+TRAIN_SAMPLES = (100, 500, 1000, 2000)
+UPDATE_USERS = (10, 50, 200)
+SAMPLES_PER_USER = 10
+
+
+def bench_detection(resolutions, repeat):
+    """Cascade detection per frame, downscaled to DETECT_WIDTH and at full resolution"""
+    rng = np.random.default_rng(0)
+    cascade = face_pipeline.get_cascade()
+    results = []
+    for width, height in resolutions:
+        gray = synthetic_frame(rng, width, height)
+        _, jpeg = cv2.imencode('.jpg', cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        results.append({
+            'resolution': f"{width}x{height}",
+            'detect_width': face_pipeline.DETECT_WIDTH,
+            'detect': timed(lambda: face_pipeline.detect_largest_face(gray, cascade), repeat),
+            'detect_full_resolution': timed(lambda: face_pipeline._detect_scaled(cascade, gray, 1.0), repeat),
+            'process_frame_bytes': timed(lambda: face_pipeline.process_frame_bytes(jpeg.tobytes()), repeat)
+        })
+    return results
+
+
+def bench_predict(user_counts, probes):
+    """predict() against galleries of one sample per user, for each matcher"""
+    rng = np.random.default_rng(1)
+    bases = [synthetic_face(rng) for _ in range(max(user_counts))]
+    probe_faces = [face_samples(bases[i], rng, 1)[0] for i in range(probes)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        system = FaceRecognitionSystem(data_dir)
+        for users in user_counts:
+            faces = [base.astype(np.uint8) for base in bases[:users]]
+            recognizer = cv2.face.LBPHFaceRecognizer_create()
+            recognizer.train(faces, np.arange(users, dtype=np.int32))
+            recognizer = SegmentedLBPH.from_recognizer(recognizer)
+            result = {'users': users, 'samples': users}
+            # One matcher at a time: a 10k-row gallery is ~650 MB of float32
+            for name, mode, metric in (('lbph', None, None), ('exact', 'exact', 'chi2'), ('exact_l2', 'exact', 'l2')):
+                matcher = GalleryMatcher.from_recognizer(recognizer, mode, metric) if mode else None
+                snapshot = ModelSnapshot(recognizer, matcher, {}, frozenset(), 0, None, None)
+                probe_iter = itertools.cycle(probe_faces)
+                result[name] = timed(lambda snapshot=snapshot: system.predict(next(probe_iter), snapshot),
+                                     repeat=probes)
+                del matcher, snapshot
+            results.append(result)
+    return results
+
+
+def bench_train(sample_counts):
+    """Full train_model() against the number of stored samples"""
+    rng = np.random.default_rng(2)
+    results = []
+    for samples in sample_counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            system = FaceRecognitionSystem(data_dir)
+            for user in range(samples // SAMPLES_PER_USER):
+                faces = [synthetic_face(rng).astype(np.uint8) for _ in range(SAMPLES_PER_USER)]
+                system.enroll(f"user{user}", faces)
+            results.append({
+                'samples': samples,
+                'users': samples // SAMPLES_PER_USER,
+                'train_model': timed(system.train_model, repeat=1, warmup=0)
+            })
+    return results
+
+
+def bench_update(user_counts):
+    """update_models() for one newly enrolled user against the number of trained users"""
+    rng = np.random.default_rng(3)
+    results = []
+    for users in user_counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            system = FaceRecognitionSystem(data_dir)
+            for user in range(users):
+                faces = [synthetic_face(rng).astype(np.uint8) for _ in range(SAMPLES_PER_USER)]
+                system.enroll(f"user{user}", faces)
+            system.train_model()
+
+            def enroll_and_update():
+                faces = [synthetic_face(rng).astype(np.uint8) for _ in range(SAMPLES_PER_USER)]
+                system.update_models([system.enroll(f"user{len(system.face_data)}", faces)])
+
+            results.append({
+                'users': users,
+                'samples': users * SAMPLES_PER_USER,
+                'enroll_and_update': timed(enroll_and_update, repeat=5)
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help="small sizes for a smoke run")
+    parser.add_argument('--users', help="comma separated gallery sizes for predict")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    user_counts = GALLERY_USERS[:2] if args.quick else GALLERY_USERS
+    if args.users:
+        user_counts = tuple(int(n) for n in args.users.split(','))
+    sample_counts = TRAIN_SAMPLES[:2] if args.quick else TRAIN_SAMPLES
+
+    # Keep stdout for the JSON report; the app's progress prints go to stderr
+    with redirect_stdout(sys.stderr):
+        results = {
+            'detection': bench_detection(RESOLUTIONS, args.repeat),
+            'predict': bench_predict(user_counts, probes=args.repeat),
+            'train': bench_train(sample_counts),
+            'update': bench_update(UPDATE_USERS[:2] if args.quick else UPDATE_USERS)
+        }
+    return emit('face_pipeline', results)
+
+
+if __name__ == '__main__':
+    main()
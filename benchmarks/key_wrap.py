@@ -0,0 +1,55 @@
+"""Wrap/unwrap throughput of the RSA-OAEP and X25519 key wrapping schemes.
+
+Run from the repository root:
+
+    python -m benchmarks.key_wrap [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+from cryptography.hazmat.primitives.asymmetric import x25519
+
+from src.encryption import key_manager
+from src.encryption.key_wrap import wrap_key, unwrap_key
+
+
+def _rate(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    return round(iterations / elapsed, 1)
+
+
+def bench_scheme(algorithm, iterations):
+    key_pair = key_manager.generate_key_pair(algorithm)
+    public_key, private_key = key_pair['public_key'], key_pair['private_key']
+    file_key = os.urandom(32)
+    wrapped = wrap_key(file_key, public_key)
+    assert unwrap_key(wrapped, private_key) == file_key
+
+    result = {
+        'algorithm': algorithm,
+        'wrap_per_sec': _rate(lambda: wrap_key(file_key, public_key), iterations),
+        'unwrap_per_sec': _rate(lambda: unwrap_key(wrapped, private_key), iterations),
+        'public_key_chars': len(key_manager.serialize_public_key(public_key)),
+        'wrapped_key_chars': len(json.dumps(wrapped))
+    }
+    if algorithm == 'X25519':
+        # encrypt_file_for_users reuses one ephemeral key for every recipient
+        ephemeral_key = x25519.X25519PrivateKey.generate()
+        result['wrap_shared_ephemeral_per_sec'] = _rate(
+            lambda: wrap_key(file_key, public_key, ephemeral_key), iterations)
+    return result
+
+
+def main(iterations=200):
+    results = [bench_scheme(algorithm, iterations) for algorithm in ('RSA', 'X25519')]
+    print(json.dumps({'iterations': iterations, 'results': results}, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
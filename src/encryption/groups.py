@@ -0,0 +1,193 @@
+from src.encryption import key_manager
+from src.encryption.user_directory import user_directory, USER_DIRECTORY_TTL
+from src.storage.metadata_store import get_metadata_store
+from src.encryption.key_wrap import wrap_key, unwrap_key, wrap_key_symmetric, unwrap_key_symmetric
+from cryptography.hazmat.primitives.asymmetric import x25519
+from datetime import datetime
+import os
+import threading
+import time
+
+GROUP_KEY_SIZE = 32
+# Re-reads of a group that another writer changed mid-update before giving up
+GROUP_UPDATE_ATTEMPTS = 3
+
+
+class GroupConflictError(Exception):
+    """The group kept changing while a membership update was applied"""
+
+
+class RecipientGroups:
+    """
+    Named recipient groups kept in the metadata store. Each group
+    has a 256-bit group key wrapped once per member, so a file shared with
+    a group wraps its file key once (AES-KW) whatever the group size.
+
+    Removing a member rotates the group key. The previous key is wrapped
+    under the new one in 'chain', so remaining and future members can
+    still open files shared before the rotation without rewrapping them.
+
+    Membership changes are compare-and-set writes: each bumps 'revision',
+    and a write is rejected and retried from a fresh read if another
+    thread or process changed the group since it was read.
+    """
+
+    def __init__(self, ttl=USER_DIRECTORY_TTL):
+        self.ttl = ttl
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, group_id, group):
+        with self._lock:
+            if group:
+                self._groups[group_id] = (time.monotonic(), group)
+            else:
+                self._groups.pop(group_id, None)
+
+    def get(self, group_id, fresh=False):
+        """Return the group record, from the cache unless fresh or expired"""
+        with self._lock:
+            entry = self._groups.get(group_id)
+        if not fresh and entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        group = get_metadata_store().group(group_id)
+        self._cache(group_id, group)
+        return group
+
+    def list(self):
+        groups = get_metadata_store().groups()
+        for group_id, group in groups.items():
+            self._cache(group_id, group)
+        return groups
+
+    def _update(self, group_id, actor_id, change):
+        """Apply change(group) to a fresh read and write it back unless the
+        group changed meanwhile, retrying from a new read on a conflict.
+
+        change returns its result; a falsy result means nothing to write.
+        """
+        store = get_metadata_store()
+        for _ in range(GROUP_UPDATE_ATTEMPTS):
+            group, token = store.group_for_update(group_id)
+            self._check_member(group_id, group, actor_id)
+            result = change(group)
+            if not result:
+                self._cache(group_id, group)
+                return result
+            group['revision'] = group.get('revision', 0) + 1
+            if store.replace_group(group_id, group, token):
+                self._cache(group_id, group)
+                return result
+        raise GroupConflictError(f"Group {group_id} changed during the update, try again")
+
+    def _wrap_for_members(self, group_key, member_ids):
+        wrapped = {}
+        ephemeral_key = None
+        for member_id in member_ids:
+            public_key = user_directory.public_key(member_id)
+            if public_key is None:
+                raise ValueError(f"No public key found for user {member_id}")
+            if isinstance(public_key, x25519.X25519PublicKey) and ephemeral_key is None:
+                ephemeral_key = x25519.X25519PrivateKey.generate()
+            wrapped[member_id] = wrap_key(group_key, public_key, ephemeral_key)
+        return wrapped
+
+    def _member_group(self, group_id, user_id):
+        """Return the group if user_id is a member, re-reading it once on a cache miss"""
+        group = self.get(group_id)
+        if not group or user_id not in group.get('members', {}):
+            group = self.get(group_id, fresh=True)
+        self._check_member(group_id, group, user_id)
+        return group
+
+    def _check_member(self, group_id, group, user_id):
+        if not group:
+            raise KeyError(f"Group {group_id} not found")
+        if user_id not in group.get('members', {}):
+            raise PermissionError(f"User {user_id} is not a member of group {group_id}")
+
+    def _unwrap_group_key(self, group, user_id, version=None):
+        private_key = key_manager.private_key_cache.get(user_id)
+        if private_key is None:
+            raise Exception("Private key not found for user")
+        group_key = unwrap_key(group['members'][user_id], private_key)
+
+        # Walk the rotation chain back to the version the file was wrapped with
+        current = group['version']
+        chain = group.get('chain', {})
+        while version is not None and current > version:
+            current -= 1
+            group_key = unwrap_key_symmetric(chain[f"v{current}"], group_key)
+        return group_key
+
+    def is_member(self, group_id, user_id, refresh=False):
+        """Membership from the cache; with refresh, a miss re-reads the group once"""
+        group = self.get(group_id)
+        if refresh and (not group or user_id not in group.get('members', {})):
+            group = self.get(group_id, fresh=True)
+        return bool(group) and user_id in group.get('members', {})
+
+    def create(self, name, owner_id, member_ids):
+        """Create a group owned by owner_id; the owner is always a member"""
+        members = list(dict.fromkeys([owner_id, *member_ids]))
+        group_key = os.urandom(GROUP_KEY_SIZE)
+        group = {
+            'name': name,
+            'owner_id': owner_id,
+            'version': 1,
+            'members': self._wrap_for_members(group_key, members),
+            'created_at': datetime.now().isoformat()
+        }
+        group_id = get_metadata_store().add_group(group)
+        self._cache(group_id, group)
+        return group_id, group
+
+    def add_members(self, group_id, actor_id, member_ids):
+        """Wrap the current group key for new members; actor_id must be a member"""
+        def change(group):
+            new_members = [m for m in dict.fromkeys(member_ids) if m not in group['members']]
+            if new_members:
+                group_key = self._unwrap_group_key(group, actor_id)
+                group['members'].update(self._wrap_for_members(group_key, new_members))
+            return new_members
+
+        return self._update(group_id, actor_id, change)
+
+    def remove_members(self, group_id, actor_id, member_ids):
+        """Drop members and rotate the group key so they cannot open new files"""
+        def change(group):
+            removed = [m for m in dict.fromkeys(member_ids) if m in group['members']]
+            if group['owner_id'] in removed:
+                raise ValueError("The group owner cannot be removed")
+            if not removed:
+                return removed
+
+            old_key = self._unwrap_group_key(group, actor_id)
+            new_key = os.urandom(GROUP_KEY_SIZE)
+            remaining = [m for m in group['members'] if m not in removed]
+            group.setdefault('chain', {})[f"v{group['version']}"] = wrap_key_symmetric(old_key, new_key)
+            group['version'] += 1
+            group['members'] = self._wrap_for_members(new_key, remaining)
+            return removed
+
+        return self._update(group_id, actor_id, change)
+
+    def wrap_file_key(self, group_id, sender_id, file_key):
+        """Wrap a file key under the current group key; sender_id must be a member"""
+        # Always re-read so a rotation made by another process is not missed
+        self.get(group_id, fresh=True)
+        group = self._member_group(group_id, sender_id)
+        wrapped = wrap_key_symmetric(file_key, self._unwrap_group_key(group, sender_id))
+        wrapped['version'] = group['version']
+        return wrapped
+
+    def unwrap_file_key(self, group_id, user_id, wrapped):
+        group = self._member_group(group_id, user_id)
+        if group['version'] < wrapped['version']:
+            group = self.get(group_id, fresh=True)
+            if user_id not in group.get('members', {}):
+                raise PermissionError(f"User {user_id} is not a member of group {group_id}")
+        return unwrap_key_symmetric(wrapped, self._unwrap_group_key(group, user_id, wrapped['version']))
+
+
+recipient_groups = RecipientGroups()
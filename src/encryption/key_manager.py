@@ -1,15 +1,79 @@
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
+from collections import OrderedDict
+from src.encryption.key_pool import key_pool
+import base64
 import os
+import threading
 
-def generate_keys(user_id):
-    """Generate RSA key pair for a user"""
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048
-    )
+# 'RSA' (RSA-2048, OAEP key wrapping) or 'X25519' (ECDH + HKDF + AES-KW)
+KEY_ALGORITHM = os.getenv('KEY_ALGORITHM', 'RSA')
+PRIVATE_KEY_CACHE_SIZE = int(os.getenv('PRIVATE_KEY_CACHE_SIZE', 128))
+
+def private_key_path(user_id):
+    return f"data/keys/{user_id}_private_key.pem"
+
+class PrivateKeyCache:
+    """
+    Bounded LRU cache of deserialized private keys. Each entry remembers the
+    key file's mtime and is reloaded when the file changes on disk.
+    """
+
+    def __init__(self, maxsize=PRIVATE_KEY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the user's private key, or None if no key file exists"""
+        path = private_key_path(user_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.invalidate(user_id)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            private_key = serialization.load_pem_private_key(f.read(), password=None)
+
+        with self._lock:
+            self._entries[user_id] = (mtime, private_key)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return private_key
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+private_key_cache = PrivateKeyCache()
+
+def generate_keys(user_id, algorithm=KEY_ALGORITHM):
+    """Generate a key pair for a user (RSA keys come from the key pool when possible)"""
+    private_key = generate_key_pair(algorithm)['private_key']
     
     # Create data/keys directory if it doesn't exist
     keys_dir = "data/keys"
@@ -23,15 +87,10 @@ def generate_keys(user_id):
     )
     with open(f"{keys_dir}/{user_id}_private_key.pem", "wb") as f:
         f.write(pem_private)
-    
-    # Get public key as string
-    pem_public = private_key.public_key().public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    )
+    private_key_cache.invalidate(user_id)
     
     # Return public key as string
-    return pem_public.decode('utf-8')
+    return serialize_public_key(private_key.public_key())
 
 def exchange_public_keys(users):
     """Simulate secure key exchange between users"""
@@ -47,16 +106,17 @@ def delete_user_keys(user_id):
     """Delete all keys for a specific user"""
     try:
         # Define key file paths
-        private_key_path = f"data/keys/{user_id}_private_key.pem"
+        private_key_file = private_key_path(user_id)
         public_key_path = f"data/keys/{user_id}_public_key.pem"
         
         deleted_files = []
+        private_key_cache.invalidate(user_id)
         
         # Delete private key
-        if os.path.exists(private_key_path):
-            os.remove(private_key_path)
-            deleted_files.append(private_key_path)
-            print(f"Deleted private key: {private_key_path}")
+        if os.path.exists(private_key_file):
+            os.remove(private_key_file)
+            deleted_files.append(private_key_file)
+            print(f"Deleted private key: {private_key_file}")
         
         # Delete public key
         if os.path.exists(public_key_path):
@@ -110,22 +170,43 @@ def list_user_keys():
         print(f"Error listing user keys: {e}")
         return []
 
-def generate_key_pair():
-    """Generate RSA key pair"""
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048
-    )
+def generate_key_pair(algorithm=KEY_ALGORITHM):
+    """Generate a key pair; RSA keys are taken from the key pool when possible"""
+    if algorithm == 'X25519':
+        private_key = x25519.X25519PrivateKey.generate()
+    elif algorithm == 'RSA':
+        private_key = key_pool.take()
+    else:
+        raise ValueError(f"Unsupported key algorithm: {algorithm}")
     public_key = private_key.public_key()
     return {'private_key': private_key, 'public_key': public_key}
 
+def generate_x25519_key_pair():
+    """Generate an X25519 key pair for ECDH key wrapping"""
+    return generate_key_pair('X25519')
+
+def key_algorithm(public_key):
+    """Return the algorithm tag stored alongside a user's public key"""
+    return 'X25519' if isinstance(public_key, x25519.X25519PublicKey) else 'RSA'
+
 def serialize_public_key(public_key):
-    """Serialize public key to PEM format"""
+    """Serialize public key: PEM for RSA, base64 of the raw 32 bytes for X25519"""
+    if isinstance(public_key, x25519.X25519PublicKey):
+        return base64.b64encode(public_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )).decode('utf-8')
     return public_key.public_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PublicFormat.SubjectPublicKeyInfo
     ).decode('utf-8')
 
+def load_public_key(public_key_str, algorithm='RSA'):
+    """Inverse of serialize_public_key"""
+    if algorithm == 'X25519':
+        return x25519.X25519PublicKey.from_public_bytes(base64.b64decode(public_key_str))
+    return serialization.load_pem_public_key(public_key_str.encode('utf-8'))
+
 def store_private_key(user_id, private_key):
     """Store private key locally"""
     keys_dir = "data/keys"
@@ -138,4 +219,5 @@ def store_private_key(user_id, private_key):
     )
     
     with open(f"{keys_dir}/{user_id}_private_key.pem", "wb") as f:
-        f.write(pem_private)
\ No newline at end of file
+        f.write(pem_private)
+    private_key_cache.invalidate(user_id)
\ No newline at end of file
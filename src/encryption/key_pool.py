@@ -0,0 +1,121 @@
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+KEY_POOL_SIZE = int(os.getenv('KEY_POOL_SIZE', 16))
+KEY_POOL_WORKERS = int(os.getenv('KEY_POOL_WORKERS', 1))
+
+def generate_private_key():
+    return rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=2048
+    )
+
+def _fill_pool(keys, generated):
+    """Worker process: generate keys forever, blocking while the pool is full"""
+    while True:
+        pem = generate_private_key().private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        keys.put(pem)
+        with generated.get_lock():
+            generated.value += 1
+
+class KeyPairPool:
+    """
+    Bounded reserve of pre-generated RSA-2048 private keys. Worker processes
+    keep the reserve full in the background; take() pops one in O(1) and
+    falls back to generating synchronously when the reserve is empty.
+    """
+
+    def __init__(self, size=KEY_POOL_SIZE, workers=KEY_POOL_WORKERS):
+        self.size = size
+        self.workers = workers
+        self.taken = 0
+        self.fallbacks = 0
+        self._keys = None
+        self._generated = None
+        self._processes = []
+        self._started_at = None
+        self._last_sample = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes (no-op if disabled, already running or fork is unavailable)"""
+        with self._lock:
+            if self._processes or self.size <= 0 or self.workers <= 0:
+                return
+            if 'fork' not in multiprocessing.get_all_start_methods():
+                print("Key pool disabled: fork start method unavailable")
+                return
+            ctx = multiprocessing.get_context('fork')
+            self._keys = ctx.Queue(maxsize=self.size)
+            self._generated = ctx.Value('L', 0)
+            for _ in range(self.workers):
+                process = ctx.Process(target=_fill_pool, args=(self._keys, self._generated), daemon=True)
+                process.start()
+                self._processes.append(process)
+            self._started_at = time.monotonic()
+            self._last_sample = (self._started_at, 0)
+            print(f"Key pool started: {self.workers} workers, {self.size} keys")
+
+    def stop(self):
+        with self._lock:
+            for process in self._processes:
+                process.terminate()
+            self._processes = []
+
+    def take(self):
+        """Return an RSA private key, from the reserve when possible"""
+        if self._keys is not None:
+            try:
+                pem = self._keys.get_nowait()
+                with self._lock:
+                    self.taken += 1
+                # The key was generated by our own worker, so skip the RSA
+                # consistency check, which costs about as much as keygen.
+                return serialization.load_pem_private_key(pem, password=None, unsafe_skip_rsa_key_validation=True)
+            except queue.Empty:
+                pass
+        with self._lock:
+            self.fallbacks += 1
+        return generate_private_key()
+
+    def depth(self):
+        if self._keys is None:
+            return 0
+        try:
+            return self._keys.qsize()
+        except NotImplementedError:
+            return -1
+
+    def stats(self):
+        """Pool depth plus refill rate (keys/s) since the last call and since start"""
+        now = time.monotonic()
+        generated = self._generated.value if self._generated is not None else 0
+        recent_rate = lifetime_rate = 0.0
+        with self._lock:
+            if self._last_sample is not None:
+                last_time, last_generated = self._last_sample
+                if now > last_time:
+                    recent_rate = (generated - last_generated) / (now - last_time)
+                lifetime_rate = generated / (now - self._started_at) if now > self._started_at else 0.0
+                self._last_sample = (now, generated)
+            return {
+                'depth': self.depth(),
+                'capacity': self.size,
+                'workers': len(self._processes),
+                'generated': generated,
+                'taken': self.taken,
+                'fallbacks': self.fallbacks,
+                'refill_rate': round(recent_rate, 3),
+                'refill_rate_lifetime': round(lifetime_rate, 3)
+            }
+
+key_pool = KeyPairPool()
@@ -0,0 +1,87 @@
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding as asym_padding
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from src import metrics
+import base64
+
+RSA_OAEP = 'RSA-OAEP-256'
+X25519_HKDF_AESKW = 'X25519-HKDF-SHA256-A256KW'
+A256KW = 'A256KW'
+
+OAEP_PADDING = asym_padding.OAEP(
+    mgf=asym_padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+# Wrapped keys are stored per recipient as {'alg': ..., 'key': b64, ...}.
+# Untagged base64 strings are RSA-OAEP keys written before tagging existed.
+
+def _b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+def _raw_public(public_key):
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+def _x25519_kek(shared_secret, ephemeral_public, recipient_public):
+    # Binding both public keys into the KDF lets one ephemeral key serve
+    # every recipient of a file.
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'SecureVault key wrap' + ephemeral_public + recipient_public
+    ).derive(shared_secret)
+
+def wrap_key(file_key, public_key, ephemeral_key=None):
+    """Wrap a symmetric key for one recipient's RSA or X25519 public key"""
+    if isinstance(public_key, x25519.X25519PublicKey):
+        with metrics.stage_timer('x25519_wrap'):
+            ephemeral_key = ephemeral_key or x25519.X25519PrivateKey.generate()
+            ephemeral_public = _raw_public(ephemeral_key.public_key())
+            kek = _x25519_kek(ephemeral_key.exchange(public_key), ephemeral_public, _raw_public(public_key))
+            return {
+                'alg': X25519_HKDF_AESKW,
+                'epk': _b64(ephemeral_public),
+                'key': _b64(aes_key_wrap(kek, file_key))
+            }
+    with metrics.stage_timer('rsa_wrap'):
+        return {
+            'alg': RSA_OAEP,
+            'key': _b64(public_key.encrypt(file_key, OAEP_PADDING))
+        }
+
+def wrap_key_symmetric(file_key, kek):
+    """Wrap a symmetric key under another 256-bit key, e.g. a group key"""
+    return {
+        'alg': A256KW,
+        'key': _b64(aes_key_wrap(kek, file_key))
+    }
+
+def unwrap_key_symmetric(wrapped, kek):
+    if wrapped.get('alg') != A256KW:
+        raise ValueError(f"Unsupported key wrapping algorithm: {wrapped.get('alg')}")
+    return aes_key_unwrap(kek, base64.b64decode(wrapped['key']))
+
+def unwrap_key(wrapped, private_key):
+    """Recover a symmetric key with the recipient's private key"""
+    if isinstance(wrapped, str):
+        with metrics.stage_timer('rsa_unwrap'):
+            return private_key.decrypt(base64.b64decode(wrapped), OAEP_PADDING)
+
+    alg = wrapped.get('alg')
+    if alg == RSA_OAEP:
+        with metrics.stage_timer('rsa_unwrap'):
+            return private_key.decrypt(base64.b64decode(wrapped['key']), OAEP_PADDING)
+    if alg == X25519_HKDF_AESKW:
+        with metrics.stage_timer('x25519_unwrap'):
+            ephemeral_public = base64.b64decode(wrapped['epk'])
+            shared_secret = private_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public))
+            kek = _x25519_kek(shared_secret, ephemeral_public, _raw_public(private_key.public_key()))
+            return aes_key_unwrap(kek, base64.b64decode(wrapped['key']))
+    raise ValueError(f"Unsupported key wrapping algorithm: {alg}")
@@ -0,0 +1,104 @@
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from src import metrics
+import os
+
+FORMAT_VERSION = 2
+CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 8
+
+# Format v2: the plaintext is split into CHUNK_SIZE chunks, each sealed with
+# AES-256-GCM under nonce = 8-byte random prefix || 4-byte big-endian chunk
+# counter. The AAD is a single byte marking the final chunk, so truncating,
+# reordering or appending chunks fails authentication. An empty file is one
+# empty final chunk. Ciphertext chunk i starts at i * (chunk_size + TAG_SIZE).
+
+def _nonce(nonce_prefix, counter):
+    return nonce_prefix + counter.to_bytes(4, 'big')
+
+def _aad(final):
+    return b'\x01' if final else b'\x00'
+
+def _read_exact(reader, size):
+    """Read up to size bytes, looping over short reads"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = reader.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+def encrypt_stream(key, nonce_prefix, reader, chunk_size=CHUNK_SIZE):
+    """Yield sealed ciphertext chunks for everything read from reader"""
+    aesgcm = AESGCM(key)
+    clock = metrics.StageClock('aes_encrypt')
+    counter = 0
+    chunk = _read_exact(reader, chunk_size)
+    try:
+        while True:
+            next_chunk = _read_exact(reader, chunk_size)
+            final = not next_chunk
+            yield clock.call(aesgcm.encrypt, _nonce(nonce_prefix, counter), chunk, _aad(final))
+            if final:
+                return
+            counter += 1
+            chunk = next_chunk
+    finally:
+        clock.done()
+
+def decrypt_stream(key, nonce_prefix, reader, chunk_size=CHUNK_SIZE, first_chunk=0):
+    """
+    Yield plaintext chunks from a ciphertext stream positioned at chunk
+    first_chunk. Raises cryptography.exceptions.InvalidTag on tampering.
+    """
+    aesgcm = AESGCM(key)
+    clock = metrics.StageClock('aes_decrypt')
+    sealed_size = chunk_size + TAG_SIZE
+    counter = first_chunk
+    sealed = _read_exact(reader, sealed_size)
+    try:
+        while True:
+            next_sealed = _read_exact(reader, sealed_size)
+            final = not next_sealed
+            yield clock.call(aesgcm.decrypt, _nonce(nonce_prefix, counter), sealed, _aad(final))
+            if final:
+                return
+            counter += 1
+            sealed = next_sealed
+    finally:
+        clock.done()
+
+def sealed_chunk_count(ciphertext_size, chunk_size=CHUNK_SIZE):
+    """Number of sealed chunks in a ciphertext of ciphertext_size bytes"""
+    return max(1, -(-ciphertext_size // (chunk_size + TAG_SIZE)))
+
+def decrypt_range(key, nonce_prefix, reader, ciphertext_size, start, stop, chunk_size=CHUNK_SIZE):
+    """
+    Yield plaintext bytes [start, stop), decrypting only the chunks that
+    cover them. reader must be seekable.
+    """
+    if stop <= start:
+        return
+    aesgcm = AESGCM(key)
+    sealed_size = chunk_size + TAG_SIZE
+    last_index = sealed_chunk_count(ciphertext_size, chunk_size) - 1
+    first = start // chunk_size
+    last = min((stop - 1) // chunk_size, last_index)
+
+    clock = metrics.StageClock('aes_decrypt')
+    reader.seek(first * sealed_size)
+    try:
+        for counter in range(first, last + 1):
+            sealed = _read_exact(reader, sealed_size)
+            chunk = clock.call(aesgcm.decrypt, _nonce(nonce_prefix, counter), sealed, _aad(counter == last_index))
+            chunk_start = counter * chunk_size
+            yield chunk[max(start - chunk_start, 0):stop - chunk_start]
+    finally:
+        clock.done()
+
+def new_file_key():
+    """Return (aes_key, nonce_prefix) for a new file"""
+    return AESGCM.generate_key(bit_length=256), os.urandom(NONCE_PREFIX_SIZE)
@@ -0,0 +1,86 @@
+from src.encryption import key_manager
+from src.storage.metadata_store import get_metadata_store
+import os
+import threading
+import time
+
+USER_DIRECTORY_TTL = float(os.getenv('USER_DIRECTORY_TTL', 300))
+
+class UserDirectory:
+    """
+    In-process cache of the users in the metadata store, indexed by username
+    and userid. Entries expire after a TTL; misses use a targeted indexed
+    lookup instead of downloading every user.
+    """
+
+    def __init__(self, ttl=USER_DIRECTORY_TTL):
+        self.ttl = ttl
+        self._by_username = {}
+        self._by_userid = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry['loaded_at'] < self.ttl
+
+    def add(self, user_data):
+        """Cache a user record, e.g. right after it was added to the metadata store"""
+        entry = {
+            'username': user_data.get('username'),
+            'userid': user_data.get('userid'),
+            'public_key_pem': user_data.get('public_key'),
+            'key_algorithm': user_data.get('key_algorithm', 'RSA'),
+            'public_key': None,
+            'loaded_at': time.monotonic()
+        }
+        with self._lock:
+            if entry['username']:
+                self._by_username[entry['username']] = entry
+            if entry['userid']:
+                self._by_userid[entry['userid']] = entry
+        return entry
+
+    def prime(self, users):
+        """Cache every record of an already-fetched users node"""
+        for user_data in (users or {}).values():
+            self.add(user_data)
+
+    def invalidate(self, userid=None, username=None):
+        """Drop one user, or the whole directory when called without arguments"""
+        with self._lock:
+            if userid is None and username is None:
+                self._by_username.clear()
+                self._by_userid.clear()
+                return
+            entry = self._by_userid.pop(userid, None) or self._by_username.pop(username, None)
+            if entry:
+                self._by_username.pop(entry['username'], None)
+                self._by_userid.pop(entry['userid'], None)
+
+    def _lookup(self, index, field, value):
+        entry = index.get(value)
+        if self._fresh(entry):
+            return entry
+
+        user_data = get_metadata_store().find_user(field, value)
+        if not user_data:
+            self.invalidate(**{field: value})
+            return None
+        return self.add(user_data)
+
+    def get_by_username(self, username):
+        return self._lookup(self._by_username, 'username', username)
+
+    def get_by_userid(self, userid):
+        return self._lookup(self._by_userid, 'userid', userid)
+
+    def public_key(self, userid):
+        """Return the deserialized public key for userid, parsing it at most once"""
+        entry = self.get_by_userid(userid)
+        if entry is None or not entry['public_key_pem']:
+            return None
+        if entry['public_key'] is None:
+            entry['public_key'] = key_manager.load_public_key(entry['public_key_pem'], entry['key_algorithm'])
+        return entry['public_key']
+
+
+user_directory = UserDirectory()
@@ -1,145 +1,197 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding, serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding as asym_padding
-import os
+from cryptography.hazmat.primitives import padding
+from src.encryption.user_directory import user_directory
+from src.encryption import key_manager
+from src.encryption import stream_cipher
+from src.encryption.key_wrap import wrap_key, unwrap_key
+from src.encryption.groups import recipient_groups
+from src import metrics
+from cryptography.hazmat.primitives.asymmetric import x25519
+import io
 import base64
-import tempfile
 
-def encrypt_file_for_users(file_content, sender_user_id, recipient_user_ids):
+def encrypt_file_for_users(file_content, sender_user_id, recipient_user_ids, output=None, group_ids=()):
     """
-    Encrypt file content for multiple recipients
+    Encrypt file content for multiple recipients using the chunked AES-GCM
+    format (version 2). file_content may be bytes or a binary file object.
+    For each of group_ids the file key is wrapped once with the group key;
+    the sender must be a member of those groups.
+    If output is a writable binary file, ciphertext is streamed there in
+    constant memory; otherwise it is returned base64-encoded in
+    'encrypted_content'.
     Returns encrypted content and metadata
     """
-    # Generate AES key for file encryption
-    aes_key = os.urandom(32)
-    iv = os.urandom(16)
-    
-    # Encrypt the file content with AES
-    cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv))
-    encryptor = cipher.encryptor()
-    
-    # Pad the file content
-    padder = padding.PKCS7(128).padder()
-    padded_data = padder.update(file_content) + padder.finalize()
-    ciphertext = encryptor.update(padded_data) + encryptor.finalize()
-    
-    # Encrypt AES key for each recipient
+    reader = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+    aes_key, nonce_prefix = stream_cipher.new_file_key()
+    # Wrap keys first so a group the sender cannot use fails before any upload
+    encrypted_keys = wrap_key_for_users(aes_key, recipient_user_ids)
+    group_keys = {
+        group_id: recipient_groups.wrap_file_key(group_id, sender_user_id, aes_key)
+        for group_id in group_ids
+    }
+
+    collected = [] if output is None else None
+    plaintext_size = 0
+    ciphertext_size = 0
+    for sealed in stream_cipher.encrypt_stream(aes_key, nonce_prefix, reader):
+        plaintext_size += len(sealed) - stream_cipher.TAG_SIZE
+        ciphertext_size += len(sealed)
+        if output is not None:
+            output.write(sealed)
+        else:
+            collected.append(sealed)
+
+    encrypted_file_data = {
+        'version': stream_cipher.FORMAT_VERSION,
+        'cipher': 'AES-256-GCM-CHUNKED',
+        'chunk_size': stream_cipher.CHUNK_SIZE,
+        'nonce_prefix': base64.b64encode(nonce_prefix).decode('utf-8'),
+        'plaintext_size': plaintext_size,
+        'ciphertext_size': ciphertext_size,
+        'encrypted_keys': encrypted_keys,
+        'sender_id': sender_user_id
+    }
+    if group_keys:
+        encrypted_file_data['group_keys'] = group_keys
+    if collected is not None:
+        encrypted_file_data['encrypted_content'] = base64.b64encode(b''.join(collected)).decode('utf-8')
+
+    return encrypted_file_data
+
+def wrap_key_for_users(aes_key, recipient_user_ids):
+    """
+    Wrap the file key for each recipient with their RSA or X25519 public key.
+    Each wrapped key carries an 'alg' tag, so RSA and X25519 users can share
+    a file. X25519 recipients share one ephemeral key per file.
+    """
     encrypted_keys = {}
+    ephemeral_key = None
     
     for recipient_id in recipient_user_ids:
         try:
-            # Load recipient's public key from Firebase (we'll need to modify this)
             recipient_public_key = load_user_public_key(recipient_id)
             
             if recipient_public_key:
-                encrypted_aes_key = recipient_public_key.encrypt(
-                    aes_key,
-                    asym_padding.OAEP(
-                        mgf=asym_padding.MGF1(algorithm=hashes.SHA256()),
-                        algorithm=hashes.SHA256(),
-                        label=None
-                    )
-                )
-                encrypted_keys[recipient_id] = base64.b64encode(encrypted_aes_key).decode('utf-8')
+                if isinstance(recipient_public_key, x25519.X25519PublicKey) and ephemeral_key is None:
+                    ephemeral_key = x25519.X25519PrivateKey.generate()
+                encrypted_keys[recipient_id] = wrap_key(aes_key, recipient_public_key, ephemeral_key)
         except Exception as e:
             print(f"Error encrypting for user {recipient_id}: {e}")
             continue
     
-    # Prepare encrypted file data
-    encrypted_file_data = {
-        'iv': base64.b64encode(iv).decode('utf-8'),
-        'encrypted_content': base64.b64encode(ciphertext).decode('utf-8'),
-        'encrypted_keys': encrypted_keys,
-        'sender_id': sender_user_id
-    }
+    return encrypted_keys
+
+def can_decrypt(encrypted_file_data, user_id):
+    """True if the user is a direct recipient or a member of a recipient group"""
+    if user_id in encrypted_file_data.get('encrypted_keys', {}):
+        return True
+    return any(recipient_groups.is_member(group_id, user_id, refresh=True)
+               for group_id in encrypted_file_data.get('group_keys', {}))
+
+def unwrap_key_for_user(encrypted_file_data, user_id):
+    """Recover the file's AES key with the user's private key, directly or via a group key"""
+    encrypted_keys = encrypted_file_data.get('encrypted_keys', {})
+    if user_id in encrypted_keys:
+        private_key = load_user_private_key(user_id)
+        if not private_key:
+            raise Exception("Private key not found for user")
+        return unwrap_key(encrypted_keys[user_id], private_key)
+
+    for group_id, wrapped in encrypted_file_data.get('group_keys', {}).items():
+        if recipient_groups.is_member(group_id, user_id, refresh=True):
+            return recipient_groups.unwrap_file_key(group_id, user_id, wrapped)
+
+    raise Exception("You don't have permission to decrypt this file")
+
+def iter_decrypt_file_for_user(encrypted_file_data, user_id, ciphertext=None):
+    """
+    Yield plaintext chunks for a specific user. ciphertext is a binary file
+    object; when omitted the base64 'encrypted_content' field is used.
+    Items without a 'version' use the original AES-CBC format.
+    """
+    aes_key = unwrap_key_for_user(encrypted_file_data, user_id)
+    if ciphertext is None:
+        ciphertext = io.BytesIO(base64.b64decode(encrypted_file_data['encrypted_content']))
+
+    if encrypted_file_data.get('version', 1) < stream_cipher.FORMAT_VERSION:
+        yield _decrypt_cbc(aes_key, base64.b64decode(encrypted_file_data['iv']), ciphertext.read())
+        return
+
+    nonce_prefix = base64.b64decode(encrypted_file_data['nonce_prefix'])
+    yield from stream_cipher.decrypt_stream(aes_key, nonce_prefix, ciphertext,
+                                            encrypted_file_data['chunk_size'])
+
+def open_decrypted_file(encrypted_file_data, user_id, open_ciphertext=None):
+    """
+    Unwrap the user's file key and return (plaintext_size, read_range), where
+    read_range(start, stop) yields plaintext bytes [start, stop).
+    open_ciphertext() must return a seekable binary file; when omitted the
+    base64 'encrypted_content' field is used. Key errors are raised here,
+    before any bytes are streamed.
+    """
+    aes_key = unwrap_key_for_user(encrypted_file_data, user_id)
+    if open_ciphertext is None:
+        content = base64.b64decode(encrypted_file_data['encrypted_content'])
+        open_ciphertext = lambda: io.BytesIO(content)
+
+    if encrypted_file_data.get('version', 1) < stream_cipher.FORMAT_VERSION:
+        # CBC items have no chunk index, so they are decrypted whole
+        with open_ciphertext() as ciphertext:
+            plaintext = _decrypt_cbc(aes_key, base64.b64decode(encrypted_file_data['iv']), ciphertext.read())
+        return len(plaintext), lambda start, stop: iter([plaintext[start:stop]])
+
+    nonce_prefix = base64.b64decode(encrypted_file_data['nonce_prefix'])
+
+    def read_range(start, stop):
+        with open_ciphertext() as ciphertext:
+            yield from stream_cipher.decrypt_range(aes_key, nonce_prefix, ciphertext,
+                                                   encrypted_file_data['ciphertext_size'], start, stop,
+                                                   encrypted_file_data['chunk_size'])
+
+    return encrypted_file_data['plaintext_size'], read_range
+
+@metrics.timed('aes_decrypt')
+def _decrypt_cbc(aes_key, iv, ciphertext):
+    cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv))
+    decryptor = cipher.decryptor()
+    padded_plaintext = decryptor.update(ciphertext) + decryptor.finalize()
     
-    return encrypted_file_data
+    # Remove padding
+    unpadder = padding.PKCS7(128).unpadder()
+    return unpadder.update(padded_plaintext) + unpadder.finalize()
 
-def decrypt_file_for_user(encrypted_file_data, user_id):
+def decrypt_file_for_user(encrypted_file_data, user_id, ciphertext=None):
     """
     Decrypt file for a specific user using their private key
     """
     try:
-        # Load user's private key
-        private_key = load_user_private_key(user_id)
-        if not private_key:
-            raise Exception("Private key not found for user")
-        
-        # Get encrypted AES key for this user
-        if user_id not in encrypted_file_data['encrypted_keys']:
-            raise Exception("You don't have permission to decrypt this file")
-        
-        encrypted_aes_key = base64.b64decode(encrypted_file_data['encrypted_keys'][user_id])
-        
-        # Decrypt AES key
-        aes_key = private_key.decrypt(
-            encrypted_aes_key,
-            asym_padding.OAEP(
-                mgf=asym_padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        
-        # Decrypt file content
-        iv = base64.b64decode(encrypted_file_data['iv'])
-        ciphertext = base64.b64decode(encrypted_file_data['encrypted_content'])
-        
-        cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv))
-        decryptor = cipher.decryptor()
-        padded_plaintext = decryptor.update(ciphertext) + decryptor.finalize()
-        
-        # Remove padding
-        unpadder = padding.PKCS7(128).unpadder()
-        plaintext = unpadder.update(padded_plaintext) + unpadder.finalize()
-        
-        return plaintext
+        return b''.join(iter_decrypt_file_for_user(encrypted_file_data, user_id, ciphertext))
         
     except Exception as e:
         print(f"Decryption error: {e}")
         raise e
 
 def load_user_public_key(user_id):
-    """Load user's public key from stored data"""
+    """Load user's public key from the cached user directory"""
     try:
-        # This will be loaded from Firebase users collection
-        from app import db
-        
-        users = db.child("users").get()
-        if users.val():
-            for key, user_data in users.val().items():
-                if user_data.get('userid') == user_id:
-                    public_key_pem = user_data.get('public_key')
-                    if public_key_pem:
-                        return serialization.load_pem_public_key(public_key_pem.encode('utf-8'))
-        return None
+        return user_directory.public_key(user_id)
     except Exception as e:
         print(f"Error loading public key for {user_id}: {e}")
         return None
 
 def load_user_private_key(user_id):
-    """Load user's private key from data/keys directory"""
+    """Load user's private key from data/keys, via the parsed-key LRU cache"""
     try:
-        private_key_path = f"data/keys/{user_id}_private_key.pem"
-        if os.path.exists(private_key_path):
-            with open(private_key_path, "rb") as f:
-                return serialization.load_pem_private_key(f.read(), password=None)
-        return None
+        return key_manager.private_key_cache.get(user_id)
     except Exception as e:
         print(f"Error loading private key for {user_id}: {e}")
         return None
 
 def get_current_user_id(username):
-    """Get user ID from username by looking up in Firebase"""
+    """Get user ID from username via the cached user directory"""
     try:
-        from app import db
-        
-        users = db.child("users").get()
-        if users.val():
-            for key, user_data in users.val().items():
-                if user_data.get('username') == username:
-                    return user_data.get('userid')
-        return None
+        entry = user_directory.get_by_username(username)
+        return entry['userid'] if entry else None
     except Exception as e:
         print(f"Error getting user ID for {username}: {e}")
         return None
\ No newline at end of file
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from src.face_store import FACE_SIZE, SAMPLE_BYTES
+
+try:
+    import fcntl
+except ImportError:  # Windows: sessions are only safe within one process
+    fcntl = None
+
+ENROLLMENT_DIR = os.getenv('ENROLLMENT_DIR', 'data/enrollment')
+# Staged faces and open sessions untouched for this long are discarded
+ENROLLMENT_TTL = float(os.getenv('ENROLLMENT_TTL', 900))
+# Cap on all enrollment bytes; least recently updated entries are evicted first
+ENROLLMENT_MAX_BYTES = int(float(os.getenv('ENROLLMENT_MAX_MB', 256)) * 1024 * 1024)
+MAX_SESSION_FACES = 50
+SWEEP_INTERVAL = 30
+# Attempts at reading a session state file before giving up on it
+STATE_READ_ATTEMPTS = 3
+
+
+class EnrollmentStore:
+    """Enrollment faces shared by every worker process on the host.
+
+    Each streaming session is a raw uint8 face file plus a small JSON state
+    file under ``sessions/``. The state file is replaced atomically while
+    the session's ``.lock`` file is held exclusively, and read under a
+    shared lock, so concurrent frames never lose an update. Finishing a session renames its faces to
+    ``staged/`` keyed by a hash of the user name, where /register_face picks
+    them up. Nothing is held in process memory, so any worker can serve any
+    request, and counts come from a single stat(). Entries expire after
+    ENROLLMENT_TTL and the oldest are evicted once the store exceeds
+    ENROLLMENT_MAX_BYTES.
+    """
+
+    def __init__(self, root=ENROLLMENT_DIR, ttl=ENROLLMENT_TTL, max_bytes=ENROLLMENT_MAX_BYTES,
+                 max_faces=MAX_SESSION_FACES):
+        self.root = Path(root)
+        self.sessions_dir = self.root / "sessions"
+        self.staged_dir = self.root / "staged"
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self.staged_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_faces = max_faces
+        self._swept_at = 0.0
+
+    def _staged_file(self, name):
+        return self.staged_dir / (hashlib.sha256(name.encode('utf-8')).hexdigest() + ".u8")
+
+    def _session_files(self, session_id):
+        if not session_id.isalnum():
+            raise KeyError(session_id)
+        return self.sessions_dir / f"{session_id}.json", self.sessions_dir / f"{session_id}.u8"
+
+    def _lock_file(self, state_file):
+        return state_file.with_suffix(".lock")
+
+    def _expired(self, stat):
+        return time.time() - stat.st_mtime > self.ttl
+
+    def _count(self, path):
+        """Number of faces in a sample file, 0 if missing or expired"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        return 0 if self._expired(stat) else stat.st_size // SAMPLE_BYTES
+
+    def _read_faces(self, path):
+        if not self._count(path):
+            return None
+        return np.fromfile(path, dtype=np.uint8).reshape((-1,) + FACE_SIZE)
+
+    @contextmanager
+    def _locked(self, state_file, exclusive=True):
+        """Hold the session's lock file; FileNotFoundError once the session is gone"""
+        with open(self._lock_file(state_file)) as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_state(self, state_file):
+        # Writes are atomic renames, so a decode error is not expected;
+        # retry a few times anyway rather than failing the request.
+        for attempt in range(STATE_READ_ATTEMPTS):
+            with open(state_file) as f:
+                try:
+                    return json.load(f)
+                except ValueError:
+                    if attempt == STATE_READ_ATTEMPTS - 1:
+                        raise
+            time.sleep(0.01)
+
+    def _write_state(self, state_file, state):
+        """Replace the state file atomically (call with the session locked)"""
+        tmp_file = state_file.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, state_file)
+
+    # Staged faces, keyed by user name
+
+    def stage(self, name, faces):
+        """Replace the faces waiting for /register_face under name"""
+        self.maybe_sweep()
+        path = self._staged_file(name)
+        tmp_file = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        np.ascontiguousarray(np.asarray(faces, dtype=np.uint8)).tofile(tmp_file)
+        os.replace(tmp_file, path)
+
+    def staged_count(self, name):
+        return self._count(self._staged_file(name))
+
+    def staged_faces(self, name):
+        """Return the staged faces as an (n, 200, 200) array, or None"""
+        return self._read_faces(self._staged_file(name))
+
+    def clear(self, name):
+        try:
+            os.remove(self._staged_file(name))
+        except FileNotFoundError:
+            pass
+
+    # Streaming sessions
+
+    def open_session(self, name, stages):
+        self.maybe_sweep()
+        session_id = uuid.uuid4().hex
+        state_file, faces_file = self._session_files(session_id)
+        faces_file.touch()
+        self._lock_file(state_file).touch()
+        state = {
+            'name': name,
+            'frames_received': 0,
+            'box': None,
+            'timings': dict.fromkeys(stages, 0.0)
+        }
+        self._write_state(state_file, state)
+        return session_id
+
+    def session(self, session_id):
+        """Return the session's state with a 'faces' count, or None if unknown or expired"""
+        try:
+            state_file, faces_file = self._session_files(session_id)
+            with self._locked(state_file, exclusive=False):
+                if self._expired(os.stat(state_file)):
+                    return None
+                state = self._read_state(state_file)
+                state['faces'] = self._count(faces_file)
+        except (KeyError, FileNotFoundError, ValueError):
+            return None
+        return state
+
+    def add_frame(self, session_id, face_roi, timings, box):
+        """Record one processed frame; returns the session's face count or None if it is gone"""
+        state_file, faces_file = self._session_files(session_id)
+        try:
+            with self._locked(state_file):
+                state = self._read_state(state_file)
+                state['frames_received'] += 1
+                for stage, seconds in timings.items():
+                    state['timings'][stage] = state['timings'].get(stage, 0.0) + seconds
+                if box is not None:
+                    state['box'] = [int(v) for v in box]
+
+                count = self._count(faces_file)
+                if face_roi is not None and count < self.max_faces:
+                    with open(faces_file, 'ab') as faces:
+                        faces.write(np.ascontiguousarray(face_roi, dtype=np.uint8).tobytes())
+                    count += 1
+
+                self._write_state(state_file, state)
+                return count
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def finish_session(self, session_id):
+        """Close a session and stage its faces under its name; returns its final state"""
+        if self.session(session_id) is None:
+            return None
+        state_file, faces_file = self._session_files(session_id)
+        try:
+            with self._locked(state_file):
+                state = self._read_state(state_file)
+                state['faces'] = self._count(faces_file)
+                if state['faces'] >= 1:
+                    os.replace(faces_file, self._staged_file(state['name']))
+                else:
+                    os.remove(faces_file)
+                os.remove(state_file)
+                os.remove(self._lock_file(state_file))
+        except (FileNotFoundError, ValueError):
+            # Another worker finished or evicted it first
+            return None
+        return state
+
+    # Eviction
+
+    def maybe_sweep(self):
+        if time.monotonic() - self._swept_at >= SWEEP_INTERVAL:
+            self.sweep()
+
+    def sweep(self):
+        """Drop expired entries, then the least recently updated ones while over max_bytes"""
+        self._swept_at = time.monotonic()
+        entries = []
+        for path in list(self.sessions_dir.glob("*.json")) + list(self.staged_dir.iterdir()):
+            # A session's face and lock files are evicted together with its state file
+            paths = ([path, path.with_suffix(".u8"), path.with_suffix(".lock")]
+                     if path.suffix == ".json" else [path])
+            try:
+                mtime = path.stat().st_mtime
+                size = sum(os.path.getsize(p) for p in paths if p.exists())
+            except FileNotFoundError:
+                continue
+            entries.append((mtime, size, paths))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        evicted = 0
+        for mtime, size, paths in entries:
+            if now - mtime <= self.ttl and total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            evicted += 1
+            total -= size
+        if evicted:
+            print(f"Evicted {evicted} enrollment entries")
+        return evicted
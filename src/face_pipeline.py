@@ -0,0 +1,202 @@
+import base64
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from src import metrics
+
+CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+MAX_WORKERS = int(os.getenv('FACE_PIPELINE_WORKERS', min(8, os.cpu_count() or 1)))
+STAGES = ('base64_decode', 'imdecode', 'grayscale', 'detect', 'resize')
+
+# Frames wider than this are downscaled before running the cascade; 0 keeps
+# full-resolution detection.
+DETECT_WIDTH = int(os.getenv('FACE_DETECT_WIDTH', 480))
+# How far the search window extends around the previous face box, as a
+# fraction of the box size on each side.
+TRACK_MARGIN = 0.5
+
+# OpenCV releases the GIL inside imdecode/cvtColor/detectMultiScale, so a
+# thread pool scales across cores. detectMultiScale keeps per-call state in
+# the CascadeClassifier, so each thread needs its own classifier; the XML is
+# parsed once per process and every thread's classifier is built from it.
+# Detection runs only on this pool (see submit), whose threads live as long
+# as the process, so warm_up() leaves no thread to build one on a request.
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='face-pipeline')
+_local = threading.local()
+_cascade_lock = threading.Lock()
+_cascade_storage = None
+
+
+def get_cascade():
+    """Return the calling thread's Haar cascade, building it on first use"""
+    global _cascade_storage
+    cascade = getattr(_local, 'cascade', None)
+    if cascade is None:
+        with _cascade_lock:
+            if _cascade_storage is None:
+                _cascade_storage = cv2.FileStorage(CASCADE_PATH, cv2.FILE_STORAGE_READ)
+            cascade = cv2.CascadeClassifier()
+            if not cascade.read(_cascade_storage.getFirstTopLevelNode()):
+                raise RuntimeError(f"Could not load Haar cascade from {CASCADE_PATH}")
+        _local.cascade = cascade
+    return cascade
+
+
+def warm_up(timeout=30):
+    """Build the Haar cascade on every pool thread, so no request pays for it"""
+    barrier = threading.Barrier(MAX_WORKERS)
+
+    def build():
+        get_cascade()
+        # Hold this thread until every task has one, so each lands on its own thread
+        try:
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            pass
+
+    for future in [_executor.submit(build) for _ in range(MAX_WORKERS)]:
+        future.result()
+
+
+class FaceTracker:
+    """Remembers the last face box of a capture sequence so the next frame is
+    only searched around it. Falls back to full-frame detection when lost."""
+
+    def __init__(self):
+        self.box = None
+
+    def detect(self, gray, cascade=None):
+        self.box = detect_largest_face(gray, cascade, previous_box=self.box)
+        return self.box
+
+
+def _detect_scaled(cascade, gray, scale, min_size=None, max_size=None):
+    scale_factor = 1.3
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # The downscaled pyramid is cheap, so step it more finely to keep
+        # recall on faces that are small after scaling.
+        scale_factor = 1.1
+    kwargs = {}
+    if min_size:
+        kwargs['minSize'] = min_size
+    if max_size:
+        kwargs['maxSize'] = max_size
+    faces = cascade.detectMultiScale(gray, scale_factor, 5, **kwargs)
+    if len(faces) == 0:
+        return None
+    (x, y, w, h) = max(faces, key=lambda f: f[2] * f[3])
+    return tuple(int(round(v / scale)) for v in (x, y, w, h))
+
+
+def detect_largest_face(gray, cascade=None, previous_box=None):
+    """Return the largest face as (x, y, w, h) in full-resolution coordinates.
+
+    The cascade runs on a frame downscaled to DETECT_WIDTH. With previous_box
+    only an expanded window around it is searched, with min/max sizes bounded
+    by the previous face, and the full frame is scanned only if that fails.
+    """
+    cascade = cascade or get_cascade()
+    height, width = gray.shape[:2]
+    scale = DETECT_WIDTH / width if DETECT_WIDTH and width > DETECT_WIDTH else 1.0
+
+    if previous_box is not None:
+        (px, py, pw, ph) = previous_box
+        x0 = max(0, int(px - pw * TRACK_MARGIN))
+        y0 = max(0, int(py - ph * TRACK_MARGIN))
+        x1 = min(width, int(px + pw * (1 + TRACK_MARGIN)))
+        y1 = min(height, int(py + ph * (1 + TRACK_MARGIN)))
+        side = max(pw, ph) * scale
+        box = _detect_scaled(cascade, gray[y0:y1, x0:x1], scale,
+                             min_size=(int(side * 0.6), int(side * 0.6)),
+                             max_size=(int(side * 1.6), int(side * 1.6)))
+        if box is not None:
+            return (box[0] + x0, box[1] + y0, box[2], box[3])
+
+    return _detect_scaled(cascade, gray, scale)
+
+
+def process_frame(image_data):
+    """Decode one data URL frame and return (200x200 face ROI or None, stage timings)"""
+    with metrics.stage_timer('base64_decode') as timer:
+        encoded = image_data.split(",", 1)[1] if ',' in image_data else image_data
+        image_bytes = base64.b64decode(encoded)
+
+    face_roi, timings = process_frame_bytes(image_bytes)
+    timings['base64_decode'] = timer.seconds
+    return face_roi, timings
+
+
+def process_frame_bytes(image_bytes, tracker=None):
+    """Detect the largest face in an encoded (JPEG/PNG) frame"""
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    with metrics.stage_timer('imdecode') as timer:
+        img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            timer.outcome = 'error'
+    timings['imdecode'] = timer.seconds
+    if img is None:
+        raise ValueError("Could not decode image")
+
+    with metrics.stage_timer('grayscale') as timer:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    timings['grayscale'] = timer.seconds
+
+    with metrics.stage_timer('detect') as timer:
+        if tracker is not None:
+            box = tracker.detect(gray)
+        else:
+            box = detect_largest_face(gray)
+        if box is None:
+            timer.outcome = 'no_face'
+    timings['detect'] = timer.seconds
+
+    if box is None:
+        return None, timings
+
+    (x, y, w, h) = box
+    with metrics.stage_timer('resize') as timer:
+        face_roi = cv2.resize(gray[y:y+h, x:x+w], (200, 200))
+    timings['resize'] = timer.seconds
+
+    return face_roi, timings
+
+
+def submit(fn, *args):
+    """Run fn on the shared worker pool in a copy of the caller's context, so
+    its stage metrics carry the request's route"""
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def process_frames(images):
+    """Process frames on the shared worker pool.
+
+    Returns the detected face ROIs in input order and a timings dict with the
+    summed CPU seconds per stage plus the wall-clock time of the whole batch.
+    """
+    start = time.perf_counter()
+    futures = [submit(process_frame, image_data) for image_data in images]
+
+    processed_faces = []
+    timings = dict.fromkeys(STAGES, 0.0)
+    for i, future in enumerate(futures):
+        try:
+            face_roi, frame_timings = future.result()
+        except Exception as e:
+            print(f"Error processing image {i}: {e}")
+            continue
+        for stage, seconds in frame_timings.items():
+            timings[stage] += seconds
+        if face_roi is not None:
+            processed_faces.append(face_roi)
+
+    timings['wall'] = time.perf_counter() - start
+    timings['workers'] = MAX_WORKERS
+    return processed_faces, timings
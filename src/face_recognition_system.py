@@ -1,57 +1,468 @@
 import cv2
 import numpy as np
-import pickle
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import as_completed
+from contextlib import contextmanager
 from pathlib import Path
+from src.face_store import FaceSampleStore, FACE_SIZE
+from src import face_pipeline
+from src.face_pipeline import detect_largest_face, process_frame, submit
+from src.face_matcher import GalleryMatcher
+from src.lbph_model import SegmentedLBPH
+from src.face_quality import select_samples
+from src import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within the process
+    fcntl = None
+
+# 'lbph' uses recognizer.predict; 'exact' and 'centroid' use the vectorized
+# GalleryMatcher (see src/face_matcher.py for the accuracy trade-offs).
+MATCHER_MODE = os.getenv('FACE_MATCHER', 'lbph')
+MATCHER_METRIC = os.getenv('FACE_MATCHER_METRIC', 'chi2')
+CONFIDENCE_THRESHOLD = float(os.getenv('FACE_CONFIDENCE_THRESHOLD', 60))
+# How often (seconds) predictions check whether another process replaced
+# face_model.xml or face_index.json; 0 checks on every prediction.
+MODEL_RELOAD_INTERVAL = float(os.getenv('FACE_MODEL_RELOAD_INTERVAL', 2))
+# Batch authentication: a frame matching below the threshold votes for its
+# user with weight 1 - distance / CONFIDENCE_THRESHOLD, and a user is
+# accepted once their votes lead every other user's by this margin.
+AUTH_VOTE_MARGIN = float(os.getenv('FACE_AUTH_VOTE_MARGIN', 0.5))
+AUTH_MAX_FRAMES = 10
+# A full train_model() runs once samples of deleted users plus samples not
+# yet in face_model.xml reach this fraction of the live gallery (and at
+# least REBUILD_MIN_SAMPLES), so its cost is amortized over those changes.
+REBUILD_FRACTION = float(os.getenv('FACE_REBUILD_FRACTION', 0.5))
+REBUILD_MIN_SAMPLES = 200
+
+# Everything predict() reads. A snapshot is never mutated after it is
+# published: writers build a new one and swap the reference, so readers
+# need no lock and never see a half-trained model. recognizer is a
+# SegmentedLBPH, whose segments are shared between successive snapshots.
+ModelSnapshot = namedtuple('ModelSnapshot', 'recognizer matcher users revoked version model_stamp index_stamp')
+
+# Default for _publish: stamp the model or index file as it is on disk now
+_CURRENT = object()
+# model_stamp of a snapshot whose model was never loaded; differs from any file stamp
+_NOT_LOADED = object()
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class _ProcessLock:
+    """Reentrant lock held across threads (RLock) and processes (flock)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            self._file = open(self.path, 'a')
+            if fcntl:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
 
 class FaceRecognitionSystem:
+    """
+    Thread- and process-safe face registry. Predictions run against the
+    current ModelSnapshot without locking. Two inter-process locks guard
+    writers: the index lock (face_index.lock) is held briefly to change
+    face_index.json, and the training lock (face_model.lock) is held while a
+    new model is built, so enrollment never waits for training.
+
+    face_model.xml is a checkpoint written by train_model() only, which
+    rebuild_if_due() runs once enough samples changed since. The model in
+    memory is that checkpoint plus every user marked trained in
+    face_index.json since, trained from the sample store; other processes
+    catch up the same way within MODEL_RELOAD_INTERVAL.
+    """
+
     def __init__(self, data_dir="data"):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
         
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create()
-        
-        self.face_data = {}
+        self.store = FaceSampleStore(self.data_dir)
         self.face_data_file = self.data_dir / "face_data.pkl"
         self.model_file = self.data_dir / "face_model.xml"
+        self.snapshot = ModelSnapshot(None, None, {}, frozenset(), 0, None, None)
+        self._index_lock = _ProcessLock(self.data_dir / "face_index.lock")
+        self._training_lock = _ProcessLock(self.data_dir / "face_model.lock")
+        self._checked_at = 0.0
+        self._ready = threading.Event()
         
         self.load_face_data()
+
+    @property
+    def face_data(self):
+        return self.snapshot.users
+
+    @contextmanager
+    def _writing(self):
+        """Hold the index lock, re-reading the index another process may have changed"""
+        with self._index_lock:
+            if self._index_lock._depth == 1:
+                self.store.load_index()
+            yield
     
     def load_face_data(self):
+        """Read the user index only. Samples stay on disk until training
+        needs them, and the model is loaded by warm_up() or the first
+        prediction."""
+        with self._writing():
+            if not self.store.users and self.face_data_file.exists():
+                self.store.migrate_pickle(self.face_data_file)
+                if self.model_file.exists():
+                    self.store.mark_trained(self.store.users)
+                    self.store.save_index()
 
-        if self.face_data_file.exists():
-            with open(self.face_data_file, 'rb') as f:
-                self.face_data = pickle.load(f)
-            print(f"Loaded {len(self.face_data)} registered users")
-            
-        if self.model_file.exists():
-            self.recognizer.read(str(self.model_file))
+            print(f"Loaded {len(self.store.users)} registered users")
+            self._publish(None, None, model_stamp=_NOT_LOADED)
+
+    def load_model(self):
+        """Load face_model.xml plus the users trained since and publish them"""
+        snapshot = self.snapshot
+        model, matcher, removed, model_stamp, index_stamp = self._catch_up(snapshot)
+        with self._writing():
+            if self.snapshot is snapshot:
+                self._publish(model, self._without_revoked(matcher, removed), model_stamp, index_stamp)
+        if model is not None:
             print("Face recognition model loaded")
 
+    def warm_up(self):
+        """Load the model, build every pool thread's cascade and run one
+        prediction, then mark the system ready"""
+        start = time.perf_counter()
+        try:
+            self.load_model()
+            face_pipeline.warm_up()
+            self.predict(np.full(FACE_SIZE, 128, dtype=np.uint8))
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+            return False
+        self._ready.set()
+        print(f"Face recognition ready in {time.perf_counter() - start:.2f}s")
+        return True
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def _read_model(self):
+        if not self.model_file.exists():
+            return None
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer.read(str(self.model_file))
+        return SegmentedLBPH.from_recognizer(recognizer)
+
+    def _save_model(self, recognizer):
+        # Write next to the model and rename, so other processes never read
+        # a partially written file
+        tmp_file = self.model_file.with_name('face_model.tmp.xml')
+        recognizer.save(str(tmp_file))
+        os.replace(tmp_file, self.model_file)
+
+    def _publish(self, recognizer, matcher, model_stamp=_CURRENT, index_stamp=_CURRENT):
+        """Swap in a new snapshot built from the store's current index.
+
+        model_stamp identifies the model file the recognizer was read from
+        and index_stamp the index whose trained users it holds; both default
+        to the files on disk, which is right just after writing them.
+        """
+        if model_stamp is _CURRENT:
+            model_stamp = _file_stamp(self.model_file)
+        if index_stamp is _CURRENT:
+            index_stamp = _file_stamp(self.store.index_file)
+        self.snapshot = ModelSnapshot(
+            recognizer=recognizer,
+            matcher=matcher,
+            users={user_id: dict(record) for user_id, record in self.store.users.items()},
+            revoked=frozenset(self.store.revoked),
+            version=self.store.model_version,
+            model_stamp=model_stamp,
+            index_stamp=index_stamp
+        )
+
+    def reload_if_changed(self):
+        """Catch up with a model or index written by another process"""
+        now = time.monotonic()
+        if now - self._checked_at < MODEL_RELOAD_INTERVAL:
+            return False
+        self._checked_at = now
+
+        snapshot = self.snapshot
+        if (_file_stamp(self.model_file) == snapshot.model_stamp
+                and _file_stamp(self.store.index_file) == snapshot.index_stamp):
+            return False
+
+        model, matcher, removed, model_stamp, index_stamp = self._catch_up(snapshot)
+        with self._writing():
+            if self.snapshot is not snapshot:
+                # A writer in this process published meanwhile
+                return False
+            # Stamps taken before reading, so a write racing this reload is
+            # picked up by the next check
+            self._publish(model, self._without_revoked(matcher, removed), model_stamp, index_stamp)
+        if model is not snapshot.recognizer:
+            print("Loaded face model changes from another process")
+        return True
+
+    def _catch_up(self, snapshot, pending=()):
+        """Return (model, matcher, removed, model_stamp, index_stamp) holding
+        every user marked trained in the index, plus pending.
+
+        Starts from the snapshot's model and reads face_model.xml only when
+        train_model() replaced it since. Users trained after the checkpoint,
+        here or by another process, are added from the sample store, so the
+        cost is proportional to their samples.
+        """
+        model_stamp = _file_stamp(self.model_file)
+        model, matcher, removed = snapshot.recognizer, snapshot.matcher, snapshot.revoked
+        if model_stamp != snapshot.model_stamp:
+            # The model file is replaced atomically, so it is read without a lock
+            model, matcher, removed = self._read_model(), None, frozenset()
+
+        with self._writing():
+            index_stamp = _file_stamp(self.store.index_file)
+            known = model.labels() if model is not None else set()
+            missing = [user_id for user_id, record in self.store.users.items()
+                       if user_id not in known and (record.get('trained', True) or user_id in pending)]
+        if missing or model is not snapshot.recognizer:
+            model, matcher = self._add_users(model, matcher, missing)
+        return model, matcher, removed, model_stamp, index_stamp
+
+    def build_matcher(self, recognizer):
+        """Build the vectorized gallery from a recognizer's histograms"""
+        if MATCHER_MODE == 'lbph' or recognizer is None:
+            return None
+        matcher = GalleryMatcher.from_recognizer(recognizer, MATCHER_MODE, MATCHER_METRIC)
+        print(f"Gallery matcher built with {len(matcher)} rows ({MATCHER_MODE}/{MATCHER_METRIC})")
+        return matcher
+
+    def _without_revoked(self, matcher, already_removed=frozenset()):
+        """Return matcher minus users revoked in the store (call under the index lock)"""
+        revoked = self.store.revoked - already_removed
+        if matcher is None or not revoked:
+            return matcher
+        matcher = matcher.copy()
+        for user_id in revoked:
+            matcher.remove(user_id)
+        return matcher
+
     
     def save_face_data(self):
 
-        with open(self.face_data_file, 'wb') as f:
-            pickle.dump(self.face_data, f)
-        
-        if len(self.face_data) > 0:
-            self.train_model()
+        self.store.save_index()
     
     def train_model(self):
-        faces = []
-        labels = []
-        
-        for user_id, user_data in self.face_data.items():
-            for face in user_data['faces']:
-                faces.append(face)
-                labels.append(user_id)
-        
-        if faces:
-            self.recognizer.train(faces, np.array(labels))
-            self.recognizer.save(str(self.model_file))
-            print("Model trained and saved")
+        """Rebuild the model from every stored sample, dropping deleted users'
+        samples, and save it as the face_model.xml checkpoint.
+
+        Training runs on a new recognizer outside the index lock; predictions
+        keep using the current snapshot until the new one is swapped in.
+        """
+        with self._training_lock:
+            with self._writing():
+                if self.store.revoked:
+                    self.store.compact()
+                compacted = set(self.store.revoked)
+                checkpoint_total = self.store.total
+                user_ids = list(self.store.users)
+                faces = []
+                labels = []
+                for user_id in user_ids:
+                    user_faces = np.array(self.store.faces(user_id))
+                    faces.extend(user_faces)
+                    labels.extend([user_id] * len(user_faces))
+            
+            recognizer = None
+            if faces:
+                recognizer = cv2.face.LBPHFaceRecognizer_create()
+                recognizer.train(faces, np.array(labels))
+                self._save_model(recognizer)
+                recognizer = SegmentedLBPH.from_recognizer(recognizer)
+                print("Model trained and saved")
+            else:
+                self.model_file.unlink(missing_ok=True)
+            matcher = self.build_matcher(recognizer)
+
+            with self._writing():
+                # Users deleted while training are still in the new model
+                self.store.revoked -= compacted
+                self.store.mark_trained(user_ids)
+                self.store.checkpoint_total = checkpoint_total
+                self.store.model_version += 1
+                self.store.save_index()
+                self._publish(recognizer, self._without_revoked(matcher))
+            return self.store.model_version
+
+    def rebuild_due(self):
+        """Whether deleted users' samples plus samples added since the
+        checkpoint are enough to make a full train_model() worthwhile"""
+        with self._writing():
+            live = self.store.live_total()
+            stale = (self.store.total - live) + (self.store.total - self.store.checkpoint_total)
+            return stale > 0 and stale >= max(REBUILD_MIN_SAMPLES, REBUILD_FRACTION * live)
+
+    def rebuild_if_due(self):
+        """Run train_model() if rebuild_due(); returns whether it ran"""
+        with self._training_lock:
+            # Checked under the training lock so processes do not rebuild twice
+            if not self.rebuild_due():
+                return False
+            self.train_model()
+            return True
+
+    def update_models(self, user_ids=None):
+        """Fold enrolled but untrained users into the model in one update.
+
+        The users are added to the in-memory model (see _catch_up) and
+        marked trained in face_index.json; face_model.xml is not rewritten,
+        so the cost does not grow with the gallery. user_ids defaults to
+        every untrained user. Returns the model version that contains them.
+        """
+        with self._training_lock:
+            with self._writing():
+                pending = self.store.untrained()
+                if user_ids is not None:
+                    pending = [user_id for user_id in pending if user_id in user_ids]
+                if not pending:
+                    return self.store.model_version
+                samples = sum(self.store.users[user_id]['count'] for user_id in pending)
+                snapshot = self.snapshot
+
+            model, matcher, removed, model_stamp, index_stamp = self._catch_up(snapshot, pending)
+
+            with self._writing():
+                self.store.mark_trained(pending)
+                self.store.model_version += 1
+                self.store.save_index()
+                self._publish(model, self._without_revoked(matcher, removed), model_stamp, index_stamp)
+            print(f"Model updated with {samples} samples for {len(pending)} users")
+            return self.store.model_version
+
+    def _add_users(self, model, matcher, user_ids):
+        """Return (model, matcher) extended with user_ids' stored samples.
+
+        The inputs are shared by the published snapshot and never modified:
+        the model gets a new segment (see SegmentedLBPH) and the matcher is
+        copied. A matcher of None is built from the new model.
+        """
+        model = model or SegmentedLBPH()
+        with self._writing():
+            new = [(user_id, np.array(self.store.faces(user_id)))
+                   for user_id in user_ids if user_id in self.store.users]
+            merged = model.merge_count(sum(len(user_faces) for _, user_faces in new))
+            batch = [(user_id, np.array(self.store.faces(user_id)))
+                     for user_id in model.tail_labels(merged) if user_id in self.store.users] + new
+
+        faces = [face for _, user_faces in batch for face in user_faces]
+        labels = [user_id for user_id, user_faces in batch for _ in user_faces]
+        model = model.replace_tail(merged, faces, labels)
+        if not model.segments:
+            return None, None
+        if matcher is None:
+            matcher = self.build_matcher(model)
+        else:
+            matcher = matcher.copy()
+            for user_id, user_faces in new:
+                matcher.add(user_id, user_faces)
+        return model, matcher
+
+    def untrained_users(self):
+        with self._writing():
+            return self.store.untrained()
+
+    def training_state(self, user_id):
+        """Return the user's index record plus the current model_version, or None.
+
+        Read from face_index.json, so every worker process sees the same state.
+        """
+        with self._writing():
+            record = self.store.users.get(user_id)
+            if record is None:
+                return None
+            return dict(record, model_version=self.store.model_version)
+
+    def mark_training_failed(self, user_ids, error):
+        with self._writing():
+            self.store.mark_failed(user_ids, error)
+            self.store.save_index()
+
+    def enroll(self, name, face_images):
+        """Store a user's best distinct samples without training; returns the new user id"""
+        face_images, stats = select_samples(face_images)
+        print(f"Selected {stats['kept']} of {stats['received']} samples for {name} "
+              f"({stats['duplicates']} near duplicates skipped)")
+        with self._writing():
+            if self.store.lookup(name) is not None:
+                # Re-enrollment replaces the user's samples under a fresh id.
+                self.delete_user(name)
+
+            user_id = self.store.allocate_id()
+            self.store.append(user_id, name, face_images)
+            snapshot = self.snapshot
+            self._publish(snapshot.recognizer, snapshot.matcher, snapshot.model_stamp, snapshot.index_stamp)
+            return user_id
+
+    def delete_user(self, name):
+        """Remove a user without retraining.
+
+        The user's id is revoked: it is dropped from the vectorized matcher
+        and skipped by LBPH predictions until the next full train_model().
+        """
+        with self._writing():
+            user_id = self.store.lookup(name)
+            if user_id is None:
+                return False
+
+            self.store.remove(user_id)
+            snapshot = self.snapshot
+            self._publish(snapshot.recognizer, self._without_revoked(snapshot.matcher, snapshot.revoked),
+                          snapshot.model_stamp, snapshot.index_stamp)
+            print(f"Deleted user {name} (id {user_id})")
+            return True
+
+    def predict(self, face_roi, snapshot=None):
+        """Return (label, distance) of the closest non-revoked gallery entry"""
+        snapshot = snapshot or self.snapshot
+        if snapshot.matcher is not None:
+            matches = snapshot.matcher.match(face_roi, k=1)
+            return matches[0] if matches else (None, float('inf'))
+
+        if snapshot.recognizer is None:
+            return None, float('inf')
+
+        if not snapshot.revoked:
+            return snapshot.recognizer.predict(face_roi)
+
+        for label, distance in snapshot.recognizer.predict_all(face_roi):
+            if label not in snapshot.revoked:
+                return label, distance
+        return None, float('inf')
     
     def register_face(self, name, face_images):
+        """Enroll and train synchronously (the web app queues training instead)"""
         try:
             print(f"Registering face for: {name} with {len(face_images)} images")
 
@@ -59,17 +470,11 @@ class FaceRecognitionSystem:
                 print("Not enough images provided for training.")
                 return False
 
-            user_id = len(self.face_data) + 1
-            
-            self.face_data[user_id] = {
-                'name': name,
-                'faces': face_images
-            }
-
-            self.save_face_data()
-            self.train_model()  
+            user_id = self.enroll(name, face_images)
+            self.update_models([user_id])
+            kept = self.snapshot.users.get(user_id, {}).get('count', 0)
             
-            print(f"Registration complete for {name}. Trained with {len(face_images)} samples.")
+            print(f"Registration complete for {name}. Trained with {kept} of {len(face_images)} samples.")
             return True
             
         except Exception as e:
@@ -82,41 +487,50 @@ class FaceRecognitionSystem:
                 print("No image provided")
                 return None
             
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
+            with metrics.stage_timer('grayscale'):
+                if len(image.shape) == 3:
+                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                else:
+                    gray = image
         
-            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+            with metrics.stage_timer('detect') as timer:
+                # On the pool, whose threads keep their cascade across requests
+                largest_face = submit(detect_largest_face, gray).result()
+                if largest_face is None:
+                    timer.outcome = 'no_face'
             
-            if len(faces) == 0:
+            if largest_face is None:
                 print("No face found in the image")
                 return None
             
-            largest_face = max(faces, key=lambda f: f[2] * f[3])
             (x, y, w, h) = largest_face
             
-            face_roi = gray[y:y+h, x:x+w]
-            face_roi = cv2.resize(face_roi, (200, 200))
+            with metrics.stage_timer('resize'):
+                face_roi = gray[y:y+h, x:x+w]
+                face_roi = cv2.resize(face_roi, (200, 200))
             
-            if not self.model_file.exists():
+            self.reload_if_changed()
+            snapshot = self.snapshot
+            if snapshot.recognizer is None:
                 print("No trained model found. Please register faces first.")
                 return None
             
-            label, confidence = self.recognizer.predict(face_roi)
+            with metrics.stage_timer('predict') as timer:
+                label, confidence = self.predict(face_roi, snapshot)
+                data = snapshot.users.get(label)
+                recognized = confidence < CONFIDENCE_THRESHOLD and data is not None
+                timer.outcome = 'match' if recognized else 'no_match'
             
-            if confidence < 60:  # Lower confidence means better match in OpenCV
-                for user_id, data in self.face_data.items():
-                    if user_id == label:
-                        # Calculate confidence percentage (invert since lower is better)
-                        confidence_percent = max(0, 100 - confidence)
-                        print(f"Face recognized: {data['name']} (confidence: {confidence:.2f})")
-                        return {
-                            'name': data['name'],
-                            'confidence': confidence,
-                            'confidence_percent': confidence_percent,  # Add this line
-                            'user_id': user_id
-                        }
+            if recognized:  # Lower confidence means better match in OpenCV
+                # Calculate confidence percentage (invert since lower is better)
+                confidence_percent = max(0, 100 - confidence)
+                print(f"Face recognized: {data['name']} (confidence: {confidence:.2f})")
+                return {
+                    'name': data['name'],
+                    'confidence': confidence,
+                    'confidence_percent': confidence_percent,
+                    'user_id': label
+                }
         
             print(f"Face not recognized (confidence: {confidence:.2f})")
             return None
@@ -125,38 +539,98 @@ class FaceRecognitionSystem:
             print(f"Error during authentication: {e}")
             return None
 
+    def _classify_frame(self, image_data, snapshot):
+        """Detect and predict one data URL frame; returns (label, distance) or None without a face"""
+        face_roi, _ = process_frame(image_data)
+        if face_roi is None:
+            return None
+        with metrics.stage_timer('predict') as timer:
+            label, distance = self.predict(face_roi, snapshot)
+            timer.outcome = 'match' if distance < CONFIDENCE_THRESHOLD else 'no_match'
+        return label, distance
+
+    def authenticate_frames(self, images, margin=AUTH_VOTE_MARGIN):
+        """Authenticate from several data URL frames at once.
+
+        Frames are detected and predicted concurrently on the face pipeline
+        pool and tallied as they finish, by confidence-weighted vote. The
+        batch stops as soon as one user leads by margin, or when the
+        remaining frames could no longer produce such a lead; frames not yet
+        started are cancelled.
+
+        Returns (result or None, stats).
+        """
+        images = images[:AUTH_MAX_FRAMES]
+        stats = {'frames': len(images), 'processed': 0, 'faces': 0, 'votes': {}, 'early_exit': False}
+
+        self.reload_if_changed()
+        snapshot = self.snapshot
+        if snapshot.recognizer is None:
+            print("No trained model found. Please register faces first.")
+            return None, stats
+
+        votes = {}
+        best = {}
+        futures = [submit(self._classify_frame, image_data, snapshot) for image_data in images]
+        for future in as_completed(futures):
+            stats['processed'] += 1
+            try:
+                prediction = future.result()
+            except Exception as e:
+                print(f"Error processing authentication frame: {e}")
+                prediction = None
+            if prediction is not None:
+                stats['faces'] += 1
+                label, distance = prediction
+                if distance < CONFIDENCE_THRESHOLD and label in snapshot.users:
+                    votes[label] = votes.get(label, 0.0) + 1.0 - distance / CONFIDENCE_THRESHOLD
+                    best[label] = min(best.get(label, distance), distance)
+
+            ranked = sorted(votes.values(), reverse=True) + [0.0, 0.0]
+            remaining = len(futures) - stats['processed']
+            # Each remaining frame adds at most 1 to a single user's votes
+            if ranked[0] - ranked[1] >= margin or ranked[0] + remaining - ranked[1] < margin:
+                stats['early_exit'] = remaining > 0
+                break
+        for pending in futures:
+            pending.cancel()
+
+        stats['votes'] = {snapshot.users[label]['name']: round(weight, 3) for label, weight in votes.items()}
+        ranked = sorted(votes.values(), reverse=True) + [0.0, 0.0]
+        if not votes or ranked[0] - ranked[1] < margin:
+            print(f"No confident match in {stats['processed']} of {len(images)} frames: {stats['votes']}")
+            return None, stats
+
+        label = max(votes, key=votes.get)
+
+        data = snapshot.users[label]
+        confidence = best[label]
+        print(f"Face recognized: {data['name']} (confidence: {confidence:.2f}, "
+              f"{stats['processed']} of {len(images)} frames)")
+        return {
+            'name': data['name'],
+            'confidence': confidence,
+            'confidence_percent': max(0, 100 - confidence),
+            'user_id': label
+        }, stats
+
     def get_registered_users(self):
         users = []
-        for user_id, data in self.face_data.items():
+        self.reload_if_changed()
+        for user_id, data in self.snapshot.users.items():
             users.append({
                 'id': int(user_id),  
             'name': str(data['name']), 
-            'face_count': len(data['faces']) if 'faces' in data else 0
+            'face_count': int(data.get('count', 0))
             })
         return users
 
     
     def register_face_direct(self, name, face_images):
-        try:
-            print(f"Registering face for: {name} with {len(face_images)} images")
+        return self.register_face(str(name), list(face_images))
 
-            if len(face_images) < 10:
-                print("Not enough images provided for training.")
-                return False
-            
-            user_id = len(self.face_data) + 1
-    
-            self.face_data[user_id] = {
-                'name': str(name),  
-                'faces': list(face_images)  
-            }
 
-            self.save_face_data()
-            self.train_model()
-            
-            print(f"Registration complete for {name}. Trained with {len(face_images)} samples.")
-            return True
-            
-        except Exception as e:
-            print(f"Error during registration: {e}")
-            return False
+if __name__ == '__main__':
+    # python -m src.face_recognition_system: full rebuild of data/ by hand
+    system = FaceRecognitionSystem()
+    print(f"Model version {system.train_model()} saved to {system.model_file}")
@@ -0,0 +1,168 @@
+import json
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+FACE_SIZE = (200, 200)
+SAMPLE_BYTES = FACE_SIZE[0] * FACE_SIZE[1]
+
+
+class FaceSampleStore:
+    """Append-only face sample store backed by a memory-mapped uint8 file.
+
+    All samples live back to back in ``face_samples.u8``. ``face_index.json``
+    maps each user id to its name, first sample offset and sample count, so
+    listing users never touches pixel data. It is also the user registry:
+    ids come from a monotonic counter and are never reused, ``names`` maps
+    each name to its current id, and ``revoked`` lists deleted ids whose
+    samples are still in the trained model. A user's ``trained`` flag is
+    False until its samples are in the model, ``training_error`` holds the
+    last failure, ``model_version`` counts model writes, and
+    ``checkpoint_total`` is the number of samples on disk when
+    face_model.xml was last written.
+    """
+
+    def __init__(self, data_dir="data"):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(exist_ok=True)
+
+        self.samples_file = self.data_dir / "face_samples.u8"
+        self.index_file = self.data_dir / "face_index.json"
+
+        self.users = {}
+        self.names = {}
+        self.revoked = set()
+        self.next_id = 1
+        self.total = 0
+        self.model_version = 0
+        self.checkpoint_total = 0
+        self._samples = None
+
+        self.load_index()
+
+    def load_index(self):
+        if self.index_file.exists():
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            self.users = {int(user_id): record for user_id, record in index['users'].items()}
+            self.total = index['total']
+            self.revoked = set(index.get('revoked', []))
+            self.next_id = index.get('next_id', max(self.users, default=0) + 1)
+            self.model_version = index.get('model_version', 0)
+            self.checkpoint_total = index.get('checkpoint_total', 0)
+        self.names = {record['name']: user_id for user_id, record in self.users.items()}
+        self._samples = None
+
+    def save_index(self):
+        index = {
+            'total': self.total,
+            'next_id': self.next_id,
+            'model_version': self.model_version,
+            'checkpoint_total': self.checkpoint_total,
+            'revoked': sorted(self.revoked),
+            'users': {str(user_id): record for user_id, record in self.users.items()}
+        }
+        tmp_file = self.index_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, self.index_file)
+
+    def allocate_id(self):
+        user_id = self.next_id
+        self.next_id += 1
+        return user_id
+
+    def lookup(self, name):
+        """Return the current user id for name, or None"""
+        return self.names.get(name)
+
+    def remove(self, user_id):
+        """Drop a user from the registry; its samples stay on disk until compaction"""
+        record = self.users.pop(user_id, None)
+        if record is None:
+            return None
+        if self.names.get(record['name']) == user_id:
+            del self.names[record['name']]
+        self.revoked.add(user_id)
+        self.save_index()
+        return record
+
+    def append(self, user_id, name, face_images):
+        """Append one user's samples; cost is proportional to len(face_images)"""
+        samples = np.stack([np.asarray(face, dtype=np.uint8).reshape(FACE_SIZE) for face in face_images])
+
+        with open(self.samples_file, 'ab') as f:
+            # Derive the offset from the file itself so a crash between the
+            # data write and the index write never produces overlapping users.
+            offset = f.tell() // SAMPLE_BYTES
+            f.write(samples.tobytes())
+
+        self.users[user_id] = {
+            'name': str(name),
+            'offset': offset,
+            'count': len(samples),
+            'trained': False
+        }
+        self.names[str(name)] = user_id
+        self.next_id = max(self.next_id, user_id + 1)
+        self.total = offset + len(samples)
+        self._samples = None
+        self.save_index()
+
+    def untrained(self):
+        """Ids whose samples are stored but not yet in the model"""
+        # Records written before the flag existed are already trained
+        return [user_id for user_id, record in self.users.items() if not record.get('trained', True)]
+
+    def mark_trained(self, user_ids):
+        for user_id in user_ids:
+            if user_id in self.users:
+                self.users[user_id]['trained'] = True
+                self.users[user_id].pop('training_error', None)
+
+    def mark_failed(self, user_ids, error):
+        """Record why training failed; the users stay untrained and are retried on restart"""
+        for user_id in user_ids:
+            if user_id in self.users:
+                self.users[user_id]['training_error'] = str(error)
+
+    def live_total(self):
+        """Samples belonging to current users; the rest of the file is removed users'"""
+        return sum(record['count'] for record in self.users.values())
+
+    def compact(self):
+        """Rewrite the sample file without the samples of removed users"""
+        tmp_file = self.samples_file.with_suffix('.tmp')
+        offset = 0
+        with open(tmp_file, 'wb') as f:
+            for user_id, record in self.users.items():
+                f.write(np.ascontiguousarray(self.faces(user_id)).tobytes())
+                record['offset'] = offset
+                offset += record['count']
+        os.replace(tmp_file, self.samples_file)
+        self.total = offset
+        self._samples = None
+        self.save_index()
+
+    def samples(self):
+        """Return a read-only memory map over every stored sample"""
+        if self._samples is None and self.total > 0:
+            self._samples = np.memmap(self.samples_file, dtype=np.uint8, mode='r',
+                                      shape=(self.total,) + FACE_SIZE)
+        return self._samples
+
+    def faces(self, user_id):
+        record = self.users[user_id]
+        start = record['offset']
+        return self.samples()[start:start + record['count']]
+
+    def migrate_pickle(self, pickle_file):
+        """Import a legacy face_data.pkl into the store"""
+        with open(pickle_file, 'rb') as f:
+            face_data = pickle.load(f)
+        for user_id, data in face_data.items():
+            if data.get('faces'):
+                self.append(int(user_id), data['name'], data['faces'])
+        print(f"Migrated {len(face_data)} users from {pickle_file}")
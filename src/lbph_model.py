@@ -0,0 +1,87 @@
+"""LBPH model made of immutable cv2 recognizers ("segments").
+
+A cv2.face.LBPHFaceRecognizer can only grow in place with update(), which
+would race the predictions reading the published ModelSnapshot, and the
+only way to copy one is a full serialize and parse of every histogram.
+SegmentedLBPH never changes a recognizer once built: adding users trains a
+new segment from their samples and returns a new model sharing the old
+segments, so the cost is proportional to the new samples.
+
+Trailing segments no larger than the incoming batch are retrained together
+with it, so sizes roughly double towards the front and a model built from
+n batches has O(log n) segments. Every segment recomputes the probe's LBP
+histogram, which is what bounds their number.
+"""
+import cv2
+import numpy as np
+
+
+def _train(faces, labels):
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.train(list(faces), np.asarray(labels, dtype=np.int32))
+    return recognizer
+
+
+class SegmentedLBPH:
+    def __init__(self, segments=()):
+        # (recognizer, labels) pairs, oldest and largest first
+        self.segments = tuple(segments)
+
+    @classmethod
+    def from_recognizer(cls, recognizer):
+        return cls([(recognizer, np.asarray(recognizer.getLabels()).ravel())])
+
+    def __len__(self):
+        return sum(len(labels) for _, labels in self.segments)
+
+    def labels(self):
+        """Set of user ids with samples in the model"""
+        return {int(label) for _, labels in self.segments for label in np.unique(labels)}
+
+    def merge_count(self, count):
+        """Number of trailing segments to retrain together with a batch of count samples"""
+        merged = 0
+        while merged < len(self.segments) and len(self.segments[-1 - merged][1]) <= count:
+            count += len(self.segments[-1 - merged][1])
+            merged += 1
+        return merged
+
+    def tail_labels(self, merged):
+        """User ids in the last merged segments"""
+        if not merged:
+            return []
+        return [int(label) for label in np.unique(np.concatenate([labels for _, labels in self.segments[-merged:]]))]
+
+    def replace_tail(self, merged, faces, labels):
+        """Return a new model whose last merged segments are replaced by one trained on faces"""
+        if not merged and not len(faces):
+            return self
+        head = self.segments[:len(self.segments) - merged]
+        if not len(faces):
+            return SegmentedLBPH(head)
+        labels = np.asarray(labels, dtype=np.int32)
+        return SegmentedLBPH(head + ((_train(faces, labels), labels),))
+
+    def predict(self, face):
+        """Return (label, distance) of the closest sample, like recognizer.predict"""
+        if len(self.segments) == 1:
+            return self.segments[0][0].predict(face)
+        return min((recognizer.predict(face) for recognizer, _ in self.segments), key=lambda match: match[1])
+
+    def predict_all(self, face):
+        """Return (label, distance) for every sample, closest first"""
+        results = []
+        for recognizer, _ in self.segments:
+            collector = cv2.face.StandardCollector_create()
+            recognizer.predict_collect(face, collector)
+            results.extend(collector.getResults(True))
+        return sorted(results, key=lambda match: match[1])
+
+    # The cv2 recognizer accessors GalleryMatcher.from_recognizer reads
+
+    def getHistograms(self):
+        return [histogram for recognizer, _ in self.segments for histogram in recognizer.getHistograms()]
+
+    def getLabels(self):
+        return np.concatenate([labels for _, labels in self.segments]) if self.segments else np.empty(0, np.int32)
+
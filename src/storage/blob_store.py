@@ -0,0 +1,222 @@
+from contextlib import contextmanager
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: commits and sweeps are only serialized within one process
+    fcntl = None
+
+BLOB_STORE = os.getenv('BLOB_STORE', 'local')
+BLOB_STORE_DIR = os.getenv('BLOB_STORE_DIR', 'data/blobs')
+READ_CHUNK_SIZE = 64 * 1024
+# A blob is committed before the vault record that references it is written,
+# so unreferenced blobs younger than this are never swept
+BLOB_SWEEP_GRACE = float(os.getenv('BLOB_SWEEP_GRACE', 3600))
+# Minimum seconds between background sweeps started by maybe_sweep()
+BLOB_SWEEP_INTERVAL = float(os.getenv('BLOB_SWEEP_INTERVAL', 3600))
+
+class BlobWriter:
+    """
+    Streams bytes into a temporary file while hashing them. commit() moves
+    the file to its content address and returns the blob reference.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.tmp_dir)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        digest = self._hash.hexdigest()
+        self.store._commit(self._tmp_path, digest)
+        return {
+            'blob_id': digest,
+            'blob_size': self.size,
+            'checksum': f"sha256:{digest}"
+        }
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
+
+class LocalBlobStore:
+    """
+    Content-addressed blobs on the local filesystem, stored as raw bytes under
+    <root>/<hash[:2]>/<hash[2:4]>/<hash>. Writes land in <root>/tmp and are
+    published with an atomic rename, so readers never see partial blobs.
+
+    Plain blobs may be shared by identical uploads, so they are not deleted
+    with their vault item; sweep() removes the ones no item references.
+    Commits hold a shared lock on <root>/sweep.lock and each sweep deletion
+    an exclusive one, so a blob re-committed by a new upload is never
+    deleted under it.
+    """
+
+    def __init__(self, root=BLOB_STORE_DIR):
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_file = self.root / "sweep.lock"
+        self._swept_at = None
+        self._sweep_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with open(self.lock_file, 'a') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def path(self, blob_id):
+        if len(blob_id) != 64 or not all(c in '0123456789abcdef' for c in blob_id):
+            raise ValueError(f"Invalid blob id: {blob_id}")
+        return self.root / blob_id[:2] / blob_id[2:4] / blob_id
+
+    def writer(self):
+        return BlobWriter(self)
+
+    def _commit(self, tmp_path, blob_id):
+        target = self.path(blob_id)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with self._locked(exclusive=False):
+            if target.exists():
+                # Same content is already stored; refresh its mtime so the
+                # sweep grace period covers this upload too
+                os.remove(tmp_path)
+                os.utime(target)
+            else:
+                os.replace(tmp_path, target)
+
+    def put_stream(self, reader):
+        """Store everything read from a binary file object"""
+        with self.writer() as writer:
+            while True:
+                data = reader.read(READ_CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+            return writer.commit()
+
+    def open(self, blob_id):
+        """Return a binary file object positioned at the start of the blob"""
+        return open(self.path(blob_id), 'rb')
+
+    def size(self, blob_id):
+        return self.path(blob_id).stat().st_size
+
+    def iter_chunks(self, blob_id, start=0, length=None, chunk_size=READ_CHUNK_SIZE):
+        """Yield the blob's bytes, optionally a [start, start + length) slice"""
+        with self.open(blob_id) as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                to_read = chunk_size if remaining is None else min(chunk_size, remaining)
+                data = f.read(to_read)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def delete(self, blob_id):
+        try:
+            os.remove(self.path(blob_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sweep(self, referenced_ids, grace=BLOB_SWEEP_GRACE):
+        """Delete stored blobs not in referenced_ids and untouched for grace seconds"""
+        removed = 0
+        for path in self.root.glob("??/??/*"):
+            if path.name in referenced_ids:
+                continue
+            with self._locked(exclusive=True):
+                try:
+                    if time.time() - path.stat().st_mtime < grace:
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+            removed += 1
+        return removed
+
+    def sweep_unreferenced(self, metadata, grace=BLOB_SWEEP_GRACE):
+        """Sweep every blob no vault item in the metadata store references"""
+        try:
+            removed = self.sweep(referenced_blob_ids(metadata), grace)
+        except Exception as e:
+            print(f"Blob sweep failed: {e}")
+            return 0
+        if removed:
+            print(f"Swept {removed} unreferenced blobs")
+        return removed
+
+    def maybe_sweep(self, metadata):
+        """Start a background sweep unless one started within BLOB_SWEEP_INTERVAL"""
+        with self._sweep_lock:
+            now = time.monotonic()
+            if self._swept_at is not None and now - self._swept_at < BLOB_SWEEP_INTERVAL:
+                return False
+            self._swept_at = now
+        threading.Thread(target=self.sweep_unreferenced, args=(metadata,), name='blob-sweep', daemon=True).start()
+        return True
+
+def referenced_blob_ids(metadata, page_size=500):
+    """Ids of every blob referenced by a vault item, plain or encrypted"""
+    referenced = set()
+    cursor = None
+    while True:
+        page = metadata.vault_page(cursor, page_size + 1)
+        for _, item in page[:page_size]:
+            for blob_id in (item.get('blob_id'), item.get('encrypted_data', {}).get('blob_id')):
+                if blob_id:
+                    referenced.add(blob_id)
+        if len(page) <= page_size:
+            return referenced
+        cursor = page[page_size][0]
+
+def get_blob_store(kind=BLOB_STORE):
+    if kind == 'local':
+        return LocalBlobStore()
+    raise ValueError(f"Unknown blob store: {kind}")
+
+
+if __name__ == '__main__':
+    # python -m src.storage.blob_store: delete blobs no vault item references
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from src.storage.metadata_store import get_metadata_store
+
+    get_blob_store().sweep_unreferenced(get_metadata_store())
@@ -0,0 +1,325 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src import metrics
+
+METADATA_STORE = os.getenv('METADATA_STORE', 'firebase')
+METADATA_DB_PATH = os.getenv('METADATA_DB_PATH', 'data/metadata.db')
+USER_LOOKUP_FIELDS = ('username', 'userid')
+
+
+def _missing_index(error):
+    """True for the error Firebase returns when a query needs an .indexOn rule"""
+    return "Index not defined" in str(error)
+
+
+class FirebaseMetadataStore:
+    """
+    The users, vault and groups nodes of the Firebase Realtime Database,
+    reached through pyrebase. Record ids are Firebase push ids.
+    """
+
+    def __init__(self):
+        import pyrebase
+
+        firebase_config = {
+            "apiKey": os.getenv('FIREBASE_API_KEY'),
+            "authDomain": os.getenv('FIREBASE_AUTH_DOMAIN'),
+            "projectId": os.getenv('FIREBASE_PROJECT_ID'),
+            "storageBucket": os.getenv('FIREBASE_STORAGE_BUCKET'),
+            "messagingSenderId": os.getenv('FIREBASE_MESSAGING_SENDER_ID'),
+            "appId": os.getenv('FIREBASE_APP_ID'),
+            "measurementId": os.getenv('FIREBASE_MEASUREMENT_ID'),
+            "databaseURL": f"https://{os.getenv('FIREBASE_PROJECT_ID')}-default-rtdb.firebaseio.com/"
+        }
+        self.db = pyrebase.initialize_app(firebase_config).database()
+
+    # Users
+
+    @metrics.timed('metadata_add_user')
+    def add_user(self, user_data):
+        return self.db.child("users").push(user_data)['name']
+
+    @metrics.timed('metadata_users')
+    def users(self):
+        return self.db.child("users").get().val() or {}
+
+    @metrics.timed('metadata_find_user')
+    def find_user(self, field, value):
+        """Return the first user whose field equals value, or None"""
+        from requests.exceptions import HTTPError
+
+        if field not in USER_LOOKUP_FIELDS:
+            raise ValueError(f"Users cannot be looked up by {field}")
+        try:
+            result = self.db.child("users").order_by_child(field).equal_to(value).get().val() or {}
+        except HTTPError as e:
+            if not _missing_index(e):
+                raise
+            # Without the .indexOn rule (see README) download every user instead
+            print(f"Firebase has no index on users/{field}; scanning all users")
+            result = self.users()
+        return next((user for user in result.values() if user.get(field) == value), None)
+
+    # Vault
+
+    @metrics.timed('metadata_add_vault_item')
+    def add_vault_item(self, item):
+        return self.db.child("vault").push(item)['name']
+
+    @metrics.timed('metadata_vault_item')
+    def vault_item(self, item_id):
+        return self.db.child("vault").child(item_id).get().val()
+
+    @metrics.timed('metadata_delete_vault_item')
+    def delete_vault_item(self, item_id):
+        self.db.child("vault").child(item_id).remove()
+
+    @metrics.timed('metadata_vault_page')
+    def vault_page(self, cursor, count, sender_id=None):
+        """Return up to count (id, item) pairs ordered by id, starting at cursor"""
+        if sender_id:
+            # Indexed query on sender_id; RTDB cannot combine it with key
+            # paging, so the sender's items are paged here.
+            items = self.db.child("vault").order_by_child("sender_id").equal_to(sender_id).get().val() or {}
+            keys = sorted(k for k in items if cursor is None or k >= cursor)[:count]
+            return [(k, items[k]) for k in keys]
+
+        query = self.db.child("vault").order_by_key()
+        if cursor:
+            query = query.start_at(cursor)
+        items = query.limit_to_first(count).get().val() or {}
+        return sorted(items.items())
+
+    # Groups
+
+    @metrics.timed('metadata_add_group')
+    def add_group(self, group):
+        return self.db.child("groups").push(group)['name']
+
+    @metrics.timed('metadata_group')
+    def group(self, group_id):
+        return self.db.child("groups").child(group_id).get().val()
+
+    @metrics.timed('metadata_groups')
+    def groups(self):
+        return self.db.child("groups").get().val() or {}
+
+    @metrics.timed('metadata_set_group')
+    def set_group(self, group_id, group):
+        self.db.child("groups").child(group_id).set(group)
+
+    @metrics.timed('metadata_group_for_update')
+    def group_for_update(self, group_id):
+        """Return (group, token) where token is the record's ETag for replace_group"""
+        result = self.db.child("groups").child(group_id).get_etag()
+        return result['value'], result['ETag']
+
+    @metrics.timed('metadata_replace_group')
+    def replace_group(self, group_id, group, token):
+        """Write group only if it is unchanged since group_for_update; returns whether it was written"""
+        result = self.db.child("groups").child(group_id).conditional_set(group, token)
+        # On an ETag mismatch pyrebase returns the current ETag and value instead
+        return not (isinstance(result, dict) and 'ETag' in result and 'value' in result)
+
+
+class SQLiteMetadataStore:
+    """
+    Users, vault and groups in one local SQLite file in WAL mode, so readers
+    never wait on a writer and every worker process on the host shares it.
+    Records are stored as JSON next to indexed columns for username, userid,
+    sender_id and uploaded_at; lookups and vault pages are index range scans.
+
+    Ids are time-ordered like Firebase push ids, so vault cursors keep
+    paging in upload order.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            username TEXT,
+            userid TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_username ON users (username, id);
+        CREATE INDEX IF NOT EXISTS users_userid ON users (userid, id);
+        CREATE TABLE IF NOT EXISTS vault (
+            id TEXT PRIMARY KEY,
+            sender_id TEXT,
+            uploaded_at TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS vault_sender ON vault (sender_id, id);
+        CREATE INDEX IF NOT EXISTS vault_uploaded_at ON vault (uploaded_at);
+        CREATE TABLE IF NOT EXISTS groups (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path=METADATA_DB_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        # sqlite3 connections must stay on the thread that opened them
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def new_id(self):
+        """Time-ordered, collision resistant id: microseconds then 64 random bits"""
+        return f"{time.time_ns() // 1000:014x}{secrets.token_hex(8)}"
+
+    def _rows(self, sql, params=()):
+        return [(row[0], json.loads(row[1])) for row in self._conn().execute(sql, params)]
+
+    def _one(self, sql, params):
+        rows = self._rows(sql, params)
+        return rows[0][1] if rows else None
+
+    # Users
+
+    @metrics.timed('metadata_add_user')
+    def add_user(self, user_data, user_key=None):
+        user_key = user_key or self.new_id()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO users (id, username, userid, data) VALUES (?, ?, ?, ?)",
+            (user_key, user_data.get('username'), user_data.get('userid'), json.dumps(user_data)))
+        return user_key
+
+    @metrics.timed('metadata_users')
+    def users(self):
+        return dict(self._rows("SELECT id, data FROM users ORDER BY id"))
+
+    @metrics.timed('metadata_find_user')
+    def find_user(self, field, value):
+        """Return the first user whose field equals value, or None"""
+        if field not in USER_LOOKUP_FIELDS:
+            raise ValueError(f"Users cannot be looked up by {field}")
+        return self._one(f"SELECT id, data FROM users WHERE {field} = ? ORDER BY id LIMIT 1", (value,))
+
+    # Vault
+
+    @metrics.timed('metadata_add_vault_item')
+    def add_vault_item(self, item, item_id=None):
+        item_id = item_id or self.new_id()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO vault (id, sender_id, uploaded_at, data) VALUES (?, ?, ?, ?)",
+            (item_id, item.get('sender_id'), item.get('uploaded_at'), json.dumps(item)))
+        return item_id
+
+    @metrics.timed('metadata_vault_item')
+    def vault_item(self, item_id):
+        return self._one("SELECT id, data FROM vault WHERE id = ?", (item_id,))
+
+    @metrics.timed('metadata_delete_vault_item')
+    def delete_vault_item(self, item_id):
+        self._conn().execute("DELETE FROM vault WHERE id = ?", (item_id,))
+
+    @metrics.timed('metadata_vault_page')
+    def vault_page(self, cursor, count, sender_id=None):
+        """Return up to count (id, item) pairs ordered by id, starting at cursor"""
+        where, params = ["id >= ?"], [cursor or '']
+        if sender_id:
+            where.append("sender_id = ?")
+            params.append(sender_id)
+        return self._rows(f"SELECT id, data FROM vault WHERE {' AND '.join(where)} ORDER BY id LIMIT ?",
+                          (*params, count))
+
+    # Groups
+
+    @metrics.timed('metadata_add_group')
+    def add_group(self, group):
+        group_id = self.new_id()
+        self.set_group(group_id, group)
+        return group_id
+
+    @metrics.timed('metadata_group')
+    def group(self, group_id):
+        return self._one("SELECT id, data FROM groups WHERE id = ?", (group_id,))
+
+    @metrics.timed('metadata_groups')
+    def groups(self):
+        return dict(self._rows("SELECT id, data FROM groups ORDER BY id"))
+
+    @metrics.timed('metadata_set_group')
+    def set_group(self, group_id, group):
+        self._conn().execute("INSERT OR REPLACE INTO groups (id, data) VALUES (?, ?)",
+                             (group_id, json.dumps(group)))
+
+    @metrics.timed('metadata_group_for_update')
+    def group_for_update(self, group_id):
+        """Return (group, token) where token is the stored JSON for replace_group"""
+        row = self._conn().execute("SELECT data FROM groups WHERE id = ?", (group_id,)).fetchone()
+        return (json.loads(row[0]), row[0]) if row else (None, None)
+
+    @metrics.timed('metadata_replace_group')
+    def replace_group(self, group_id, group, token):
+        """Write group only if it is unchanged since group_for_update; returns whether it was written"""
+        cursor = self._conn().execute("UPDATE groups SET data = ? WHERE id = ? AND data = ?",
+                                      (json.dumps(group), group_id, token))
+        return cursor.rowcount == 1
+
+
+def copy_metadata(source, target, page_size=500):
+    """Copy every user, vault item and group from source into a SQLite target, keeping ids"""
+    counts = {'users': 0, 'vault': 0, 'groups': 0}
+    for user_key, user_data in source.users().items():
+        target.add_user(user_data, user_key)
+        counts['users'] += 1
+    cursor = None
+    while True:
+        page = source.vault_page(cursor, page_size + 1)
+        for item_id, item in page[:page_size]:
+            target.add_vault_item(item, item_id)
+            counts['vault'] += 1
+        if len(page) <= page_size:
+            break
+        cursor = page[page_size][0]
+    for group_id, group in source.groups().items():
+        target.set_group(group_id, group)
+        counts['groups'] += 1
+    return counts
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_metadata_store(kind=METADATA_STORE):
+    """Return the process-wide metadata store of the given kind"""
+    with _stores_lock:
+        if kind not in _stores:
+            if kind == 'firebase':
+                _stores[kind] = FirebaseMetadataStore()
+            elif kind == 'sqlite':
+                _stores[kind] = SQLiteMetadataStore()
+            else:
+                raise ValueError(f"Unknown metadata store: {kind}")
+        return _stores[kind]
+
+
+def set_metadata_store(store, kind=METADATA_STORE):
+    """Use store wherever get_metadata_store(kind) is called, e.g. a temporary SQLite file"""
+    with _stores_lock:
+        _stores[kind] = store
+
+
+if __name__ == '__main__':
+    # python -m src.storage.metadata_store: copy Firebase metadata into METADATA_DB_PATH
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    print(copy_metadata(FirebaseMetadataStore(), SQLiteMetadataStore()))
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Finished jobs kept for /training_status before the oldest are dropped
+TRAINING_JOB_HISTORY = int(os.getenv('TRAINING_JOB_HISTORY', 1000))
+JOB_PREFIX = 'user-'
+
+
+class TrainingScheduler:
+    """Background trainer for enrollments.
+
+    submit() stores the samples and returns a queued job at once. One worker
+    thread takes every job pending when it wakes and folds them into a single
+    model update, so registrations arriving together train once. Enrollment
+    cost is the sample write only, independent of gallery size.
+
+    The same thread runs the full rebuild (FaceRecognitionSystem.
+    rebuild_if_due) after each batch and when request_rebuild() is called,
+    e.g. after a deletion, so deleted users' samples are compacted away and
+    face_model.xml is saved again.
+
+    A job id names the enrolled user ("user-<id>"). The worker process that
+    took the job reports its detailed state; any other process derives the
+    status from the user's trained flag and training_error in the shared
+    face index.
+    """
+
+    def __init__(self, face_system, history=TRAINING_JOB_HISTORY):
+        self.face_system = face_system
+        self.history = history
+        self._jobs = OrderedDict()
+        self._pending = []
+        self._rebuild = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='training-scheduler', daemon=True)
+            self._thread.start()
+        # Users enrolled before a crash, or by a process that exited, are
+        # trained again; update_models skips anyone already in the model.
+        untrained = self.face_system.untrained_users()
+        if untrained:
+            self._enqueue([self._new_job(None, user_id) for user_id in untrained])
+        self.request_rebuild()
+
+    def request_rebuild(self):
+        """Have the worker rebuild the model if enough samples changed since the last rebuild"""
+        with self._cond:
+            self._rebuild = True
+            self._cond.notify()
+
+    def _new_job(self, name, user_id):
+        return {
+            'job_id': f"{JOB_PREFIX}{user_id}",
+            'name': name,
+            'user_id': user_id,
+            'status': 'queued',
+            'model_version': None,
+            'batch_size': None,
+            'error': None,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+
+    def _enqueue(self, jobs):
+        with self._cond:
+            for job in jobs:
+                self._jobs[job['job_id']] = job
+                self._pending.append(job)
+            self._trim()
+            self._cond.notify()
+
+    def _trim(self):
+        excess = len(self._jobs) - self.history
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in ('done', 'failed')][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def submit(self, name, face_images):
+        """Store a user's samples and queue them for training; returns the job"""
+        user_id = self.face_system.enroll(name, face_images)
+        job = self._new_job(name, user_id)
+        self._enqueue([job])
+        return dict(job)
+
+    def status(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        return self._shared_status(job_id)
+
+    def _shared_status(self, job_id):
+        """Status of a job submitted to another process, from the face index"""
+        if not job_id.startswith(JOB_PREFIX) or not job_id[len(JOB_PREFIX):].isdigit():
+            return None
+        user_id = int(job_id[len(JOB_PREFIX):])
+        record = self.face_system.training_state(user_id)
+        if record is None:
+            return None
+        trained = record.get('trained', True)
+        job = self._new_job(record['name'], user_id)
+        job['submitted_at'] = None
+        if trained:
+            job.update(status='done', model_version=record['model_version'])
+        elif record.get('training_error'):
+            job.update(status='failed', error=record['training_error'])
+        return job
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._rebuild:
+                    self._cond.wait()
+                batch, self._pending = self._pending, []
+                self._rebuild = False
+                for job in batch:
+                    job['status'] = 'running'
+                    job['started_at'] = time.time()
+                    job['batch_size'] = len(batch)
+
+            if batch:
+                self._train(batch)
+            try:
+                self.face_system.rebuild_if_due()
+            except Exception as e:
+                print(f"Model rebuild failed: {e}")
+
+    def _train(self, batch):
+        try:
+            version = self.face_system.update_models([job['user_id'] for job in batch])
+            result = {'status': 'done', 'model_version': version}
+        except Exception as e:
+            print(f"Training batch of {len(batch)} failed: {e}")
+            result = {'status': 'failed', 'error': str(e)}
+            try:
+                self.face_system.mark_training_failed([job['user_id'] for job in batch], e)
+            except Exception as record_error:
+                print(f"Could not record training failure: {record_error}")
+
+        with self._cond:
+            for job in batch:
+                job.update(result, finished_at=time.time())
+            self._trim()
@@ -30,7 +30,23 @@ function captureFrame() {
     return canvas.toDataURL('image/jpeg', 0.8);
 }
 
-function authenticateFace() {
+// Frames sent per attempt; the server votes across them and stops early
+// once one user clearly leads
+const AUTH_BATCH_FRAMES = 5;
+const AUTH_FRAME_INTERVAL_MS = 100;
+
+async function captureFrames(count, intervalMs) {
+    const frames = [];
+    for (let i = 0; i < count; i++) {
+        if (i > 0) {
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+        }
+        frames.push(captureFrame());
+    }
+    return frames;
+}
+
+async function authenticateFace() {
     if (!stream) {
         alert('Please start the camera first');
         return;
@@ -38,12 +54,12 @@ function authenticateFace() {
 
     document.getElementById('status').innerHTML = 'Authenticating...';
     
-    const imageData = captureFrame();
+    const images = await captureFrames(AUTH_BATCH_FRAMES, AUTH_FRAME_INTERVAL_MS);
     
-    fetch('/authenticate_face', {
+    fetch('/authenticate_batch', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({image: imageData})
+        body: JSON.stringify({images: images})
     })
     .then(response => response.json())
     .then(data => {
@@ -3,8 +3,9 @@ let canvas = document.getElementById("canvas");
 let ctx = canvas.getContext("2d");
 let stream = null;
 let capturing = false;
-let capturedImages = [];
 let captureInterval = null;
+let sessionId = null;
+let pendingUploads = [];
 
 async function startCamera() {
   try {
@@ -31,7 +32,34 @@ function stopCamera() {
 
 function captureFrame() {
   ctx.drawImage(video, 0, 0, 640, 480);
-  return canvas.toDataURL("image/jpeg", 0.8);
+  return new Promise((resolve) => canvas.toBlob(resolve, "image/jpeg", 0.8));
+}
+
+function openSession(name) {
+  return fetch("/enrollment_session", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ name: name }),
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (!data.success) {
+        throw new Error(data.message);
+      }
+      return data.session_id;
+    });
+}
+
+function sendFrame(blob) {
+  // Frames are sent as raw JPEG bytes while capturing so the server can
+  // detect faces as they arrive instead of after the whole batch.
+  return fetch(`/enrollment_session/${sessionId}/frame`, {
+    method: "POST",
+    headers: { "Content-Type": "image/jpeg" },
+    body: blob,
+  }).catch((error) => {
+    console.log(`Frame upload error: ${error}`);
+  });
 }
 
 function startCapture() {
@@ -52,57 +80,58 @@ function startCapture() {
   }
 
   capturing = true;
-  capturedImages = [];
+  pendingUploads = [];
   let count = 0;
   const totalImages = 50;
 
   document.getElementById("captureBtn").disabled = true;
-  document.getElementById("status").innerHTML =
-    "Capturing images... Keep your face visible!";
-
-  captureInterval = setInterval(() => {
-    if (count < totalImages) {
-      const imageData = captureFrame();
-      capturedImages.push(imageData);
-      count++;
-
-      const progress = (count / totalImages) * 100;
-      document.getElementById("progressBar").style.width = progress + "%";
-      document.getElementById(
-        "status"
-      ).innerHTML = `Capturing... ${count}/${totalImages} images`;
-    } else {
-      clearInterval(captureInterval);
+
+  openSession(name)
+    .then((id) => {
+      sessionId = id;
+      document.getElementById("status").innerHTML =
+        "Capturing images... Keep your face visible!";
+
+      captureInterval = setInterval(() => {
+        if (count < totalImages) {
+          pendingUploads.push(captureFrame().then(sendFrame));
+          count++;
+
+          const progress = (count / totalImages) * 100;
+          document.getElementById("progressBar").style.width = progress + "%";
+          document.getElementById(
+            "status"
+          ).innerHTML = `Capturing... ${count}/${totalImages} images`;
+        } else {
+          clearInterval(captureInterval);
+          capturing = false;
+          document.getElementById("captureBtn").disabled = false;
+          document.getElementById("registerBtn").disabled = false;
+          document.getElementById(
+            "status"
+          ).innerHTML = `Captured ${totalImages} images successfully!`;
+
+          finishSession();
+        }
+      }, 200);
+    })
+    .catch((error) => {
       capturing = false;
       document.getElementById("captureBtn").disabled = false;
-      document.getElementById("registerBtn").disabled = false;
-      document.getElementById(
-        "status"
-      ).innerHTML = `Captured ${totalImages} images successfully!`;
-
-      sendImagesToServer(name, capturedImages);
-    }
-  }, 200);
+      console.log(`Session error: ${error}`);
+    });
 }
 
-function sendImagesToServer(name, images) {
-  document.getElementById("status").innerHTML = "Uploading images to server...";
+function finishSession() {
+  document.getElementById("status").innerHTML = "Finishing upload...";
 
-  fetch("/upload_captured_images", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({
-      name: name,
-      images: images,
-    }),
-  })
+  Promise.all(pendingUploads)
+    .then(() =>
+      fetch(`/enrollment_session/${sessionId}/finish`, { method: "POST" })
+    )
     .then((response) => response.json())
     .then((data) => {
-      if (data.success) {
-        document.getElementById("status").innerHTML = ` ${data.message}`;
-      } else {
-        document.getElementById("status").innerHTML = ` ${data.message}`;
-      }
+      document.getElementById("status").innerHTML = ` ${data.message}`;
     })
     .catch((error) => {
       console.log(`Upload error: ${error}`);
@@ -129,12 +158,36 @@ function registerFace() {
         document.getElementById("nameInput").value = "";
         document.getElementById("progressBar").style.width = "0%";
         document.getElementById("registerBtn").disabled = true;
+        pollTrainingStatus(data.job_id);
       } else {
         console.log(` ${data.message}`);
       }
     });
 }
 
+function pollTrainingStatus(jobId) {
+  fetch(`/training_status/${jobId}`)
+    .then((response) => response.json())
+    .then((job) => {
+      const status = document.getElementById("status");
+      if (!job.success) {
+        status.innerHTML = ` Could not check training status: ${job.message}`;
+        return;
+      }
+      if (job.status === "done") {
+        status.innerHTML = ` Face model updated (version ${job.model_version}). You can now log in.`;
+      } else if (job.status === "failed") {
+        status.innerHTML = ` Training failed: ${job.error}`;
+      } else {
+        status.innerHTML = ` Training ${job.status}...`;
+        setTimeout(() => pollTrainingStatus(jobId), 1000);
+      }
+    })
+    .catch((error) => {
+      console.log(`Training status error: ${error}`);
+    });
+}
+
 window.onload = function () {
   startCamera();
 };